@@ -1,2 +1,8 @@
 from pyplus.sql.oopgplus import TableStructure,SchemaStructure,create_schema,create_domain,Table
-from pyplus.sql.oopgplus import get_table_list,get_schema_list
\ No newline at end of file
+from pyplus.sql.oopgplus import get_table_list,get_schema_list,get_schema_graph,SchemaGraph
+from pyplus.sql.oopgplus import CatalogCache,get_catalog_cache,StatementStats,track_statements,LookupIndex
+from pyplus.sql.oopgplus import DiskCache,enable_disk_cache,disable_disk_cache
+from pyplus.sql.oopgplus import ChangeListener,listen_changes
+from pyplus.sql.oopgplus import Session,SessionTable,session
+from pyplus.sql.oopgplus import Span,Profile,profile,add_hook,add_instrument,remove_instrument,enable_opentelemetry
+from pyplus.sql.aiopgplus import AsyncTableStructure,AsyncSchemaStructure,AsyncTable
\ No newline at end of file
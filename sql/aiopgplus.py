@@ -0,0 +1,160 @@
+import asyncio
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.util import greenlet_spawn
+from typing import Literal,Self,Any,Callable,Iterable,TYPE_CHECKING
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+from pyplus.sql.oopgplus import TableStructure,SchemaStructure
+
+async def _run[T](func:Callable[...,T],*args,**kwargs)->T:
+    '''
+    Run a synchronous method on an AsyncEngine.sync_engine without a thread.
+    Every query inside is awaited on the event loop by the async driver.
+    '''
+    return await greenlet_spawn(func,*args,**kwargs)
+
+class AsyncTableStructure:
+    '''
+    TableStructure on an AsyncEngine such as create_async_engine('postgresql+asyncpg://...').
+
+    Examples
+    --------
+    >>> ts = AsyncTableStructure('public','basket',async_engine)
+    >>> await ts.read_expand()
+    '''
+    schema_name : str
+    table_name : str
+    engine : 'AsyncEngine'
+
+    def __init__(self,schema_name:str,table_name:str,
+                 engine:'AsyncEngine',
+                 dtype_backend:Literal['numpy_nullable','pyarrow']='numpy_nullable'):
+        self.schema_name = schema_name
+        self.table_name = table_name
+        self.engine = engine
+        self.sync = TableStructure(schema_name,table_name,engine.sync_engine,dtype_backend)
+
+    def refresh(self):
+        self.sync.refresh()
+
+    async def get_identity(self)->list[str]:
+        return await _run(self.sync.get_identity)
+
+    async def get_types(self)->pd.DataFrame:
+        return await _run(self.sync.get_types)
+
+    async def get_types_expanded(self)->pd.DataFrame:
+        return await _run(self.sync.get_types_expanded)
+
+    async def get_foreign_tables(self)->dict[str,Self]:
+        foreign_tables_ts = await _run(self.sync.get_foreign_tables)
+        return {col:AsyncTableStructure(ts.schema_name,ts.table_name,self.engine,ts.dtype_backend)
+                for col,ts in foreign_tables_ts.items()}
+
+    async def read(self,ascending=False,columns:list[str]|None=None,filters:dict[str,Any]|None=None,
+                   order_by:str|list[str]|None=None,limit:int|None=None,offset:int|None=None)->pd.DataFrame:
+        if columns is None and filters is None and order_by is None and limit is None and offset is None:
+            df_content = await self._read_local()
+            return df_content.sort_index(ascending=ascending)
+        return await _run(self.sync.read,ascending,columns,filters,order_by,limit,offset)
+
+    async def read_incremental(self,by:str='xmin',ascending=False,reconcile_deletes=True)->pd.DataFrame:
+        return await _run(self.sync.read_incremental,by,ascending,reconcile_deletes)
+
+    async def preview(self,n:int=5,ascending=False)->pd.DataFrame:
+        return await _run(self.sync.preview,n,ascending)
+
+    async def count_rows(self,exact=False)->int|None:
+        return await _run(self.sync.count_rows,exact)
+
+    async def _read_local(self)->pd.DataFrame:
+        def read_local():
+            with self.sync.engine.connect() as conn:
+                return self.sync._read_typed(conn,text(f'SELECT * FROM {self.schema_name}.{self.table_name}'))
+        return await _run(read_local)
+
+    async def _read_joined(self,stmt:str,entries:list[tuple[str,str,str]])->pd.DataFrame:
+        def read_joined():
+            with self.sync.engine.connect() as conn:
+                return self.sync._read_selected(conn,text(stmt),entries)
+        return await _run(read_joined)
+
+    async def _read_merge(self,key:str,ft:TableStructure,ascending=False)->pd.DataFrame:
+        df_ftable = await AsyncTableStructure(ft.schema_name,ft.table_name,self.engine,ft.dtype_backend).read_expand(ascending)
+        return df_ftable.rename(columns={col:f'{key}.{col}' for col in df_ftable.columns.to_list()})
+
+    async def read_expand(self,ascending=False,remove_original_id=False,
+                          expansion:Literal['join','pandas']='join',
+                          selfref:Literal['wide','path']='wide',
+                          columns:list[str]|None=None,filters:dict[str,Any]|None=None,
+                          order_by:str|list[str]|None=None,limit:int|None=None,offset:int|None=None)->pd.DataFrame:
+        '''
+        Same as TableStructure.read_expand.
+
+        With expansion='join' and no columns, filters, order or limit,
+        the local table joined with its foreign tables by one query and every foreign table merged separately
+        (one with a self-referencing column) are read concurrently.
+        '''
+        if (expansion != 'join' or columns is not None or filters is not None or order_by is not None
+            or limit is not None or offset is not None):
+            return await _run(self.sync.read_expand,ascending,remove_original_id,expansion,selfref,
+                              columns,filters,order_by,limit,offset)
+        stmt,entries,merges,order = await _run(self.sync._compile_select,True)
+        df_content, *df_merges = await asyncio.gather(self._read_joined(stmt,entries),
+                                                      *[self._read_merge(key,ft,ascending) for key,ft in merges])
+        df_content, foreign_columns = self.sync._merge_foreign(df_content,merges,order,df_merges)
+        df_content = await _run(self.sync._assemble_expanded,df_content,foreign_columns,remove_original_id,selfref)
+        return df_content.sort_index(ascending=ascending)
+
+    async def upload(self,id_row:int,return_mode:Literal['none','returning','full']='full',**kwarg):
+        return await _run(self.sync.upload,id_row,return_mode,**kwarg)
+
+    async def upload_dataframe(self,df:pd.DataFrame,batch_size:int=1000,staging_threshold:int=10000):
+        return await _run(self.sync.upload_dataframe,df,batch_size,staging_threshold)
+
+    async def upload_appends(self,*row:dict[str,Any],return_mode:Literal['none','returning','full']='full'):
+        return await _run(self.sync.upload_appends,*row,return_mode=return_mode)
+
+    async def upload_appends_bulk(self,rows:pd.DataFrame|Iterable[dict[str,Any]],batch_size:int=1000,
+                                  method:Literal['copy','values']='copy')->list[int|None]:
+        return await _run(self.sync.upload_appends_bulk,rows,batch_size,method)
+
+    async def append(self,**kwarg:Any):
+        return await _run(self.sync.append,**kwarg)
+
+    async def delete_row(self,row:int):
+        return await _run(self.sync.delete_row,row)
+
+    async def delete_rows(self,*rows:int,batch_size:int=10000)->int:
+        return await _run(self.sync.delete_rows,*rows,batch_size=batch_size)
+
+    async def delete_column(self,column:str):
+        return await _run(self.sync.delete_column,column)
+
+    async def delete_columns(self,*columns:str):
+        return await _run(self.sync.delete_columns,*columns)
+
+    async def delete_table(self):
+        return await _run(self.sync.delete_table)
+
+AsyncTable = AsyncTableStructure
+
+class AsyncSchemaStructure:
+    schema_name : str
+    engine : 'AsyncEngine'
+
+    def __init__(self,schema_name:str,
+                 engine:'AsyncEngine'):
+        self.schema_name = schema_name
+        self.engine = engine
+        self.sync = SchemaStructure(schema_name,engine.sync_engine)
+
+    async def execute_sql_write(self,sql):
+        return await _run(self.sync.execute_sql_write,sql)
+
+    async def create_table(self,table_name:str,**type_dict)->AsyncTableStructure:
+        await _run(self.sync.create_table,table_name,**type_dict)
+        return AsyncTableStructure(self.schema_name,table_name,self.engine)
+
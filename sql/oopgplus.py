@@ -1,13 +1,27 @@
 import pandas as pd
 from sqlalchemy.sql import text
 import sqlalchemy
-from typing import Literal,Self,Any,Callable
+from sqlalchemy.engine import default as default_engine
+from typing import Literal,Self,Any,Callable,Iterable,Iterator
 from datetime import date,tzinfo
 from zoneinfo import ZoneInfo
 import numpy as np
-import checkpoint as chpo
-import networkx as nx
 from warnings import warn
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+import csv
+import io
+import graphlib
+import functools
+import contextvars
+import os
+import json
+import hashlib
+import select
+import multiprocessing
+from concurrent.futures import Executor,ThreadPoolExecutor,ProcessPoolExecutor
 
 
 
@@ -21,107 +35,1019 @@ SELECT {stmt_default_col[0]},
        AND column_default IS NOT NULL ;
 ''')
 
-def _apply_escaping(sentence:str):
-    return sentence.replace("'","''")
-
-def _convert_into_sql_string(val:None|int|np.integer|float|np.floating|str|date|pd.Timestamp|list)->str:
+def _is_missing(val:Any)->bool:
     match val:
         case None:
-            return 'NULL'
-        case int()|np.integer():
-            return f"'{str(val)}'"
+            return True
         case float()|np.floating():
-            return f"'{str(val)}'"
-        case str():
-            return f"'{_apply_escaping(val)}'"
+            return bool(np.isnan(val))
+        case _:
+            return val is pd.NaT or val is pd.NA
+
+def _to_db_param(val:Any)->Any:
+    '''
+    Convert a value into a type which DBAPI drivers can bind.
+    '''
+    if _is_missing(val):
+        return None
+    match val:
+        case np.generic():
+            return val.item()
         case pd.Timestamp():
-            if val.strftime('%z') != '+0000':
-                if len(val.strftime('%z'))==0:
-                    return f"'{val.strftime('%Y-%m-%d %H:%M:%S')}'"
-                else:
-                    raise NotImplementedError('Not UTC timezone.')
-            return f"'{val.strftime('%Y-%m-%d %H:%M:%S')}'"
-        case date():
-            if val is not pd.NaT:
-                escape_str = val.strftime("%Y-%m-%d")
-                return f"'{escape_str}'"
-            else:
-                return 'NULL'
+            return val.to_pydatetime()
+        case np.ndarray():
+            return [_to_db_param(v) for v in val.tolist()]
+        case list()|tuple():
+            return [_to_db_param(v) for v in val]
+        case _:
+            return val
+
+def _split_foreign_columns(row:dict[str,Any],foreign_columns:Iterable[str])->tuple[dict[str,Any],dict[str,dict[str,Any]]]:
+    '''
+    Split {'qty':3,'fruit_id.color':'red'} into local values {'qty':3} and foreign values {'fruit_id':{'color':'red'}}.
+    '''
+    local : dict[str,Any] = {}
+    foreign : dict[str,dict[str,Any]] = {}
+    for col in row:
+        local_column = col.split('.')[0]
+        if '.' in col and local_column in foreign_columns:
+            foreign.setdefault(local_column,{})[col[len(local_column)+1:]] = row[col]
+        else:
+            local[col] = row[col]
+    return local, foreign
+
+def _to_copy_field(val:Any)->str|None:
+    val = _to_db_param(val)
+    match val:
+        case None:
+            return None
+        case bool():
+            return 'true' if val else 'false'
         case list():
-            val_after = [f'"{str(v)}"' for v in val]
-            return "'{"+f"{','.join(val_after)}"+"}'"
+            def quote_item(v):
+                if v is None:
+                    return 'NULL'
+                if isinstance(v,list): #a sub-array of a multidimensional array is not quoted
+                    return _to_copy_field(v)
+                escaped = _to_copy_field(v).replace('\\','\\\\').replace('"','\\"')
+                return f'"{escaped}"'
+            return '{'+','.join([quote_item(v) for v in val])+'}'
+        case date():
+            return val.isoformat()
         case _:
-            raise NotImplementedError(type(val))
+            return str(val)
+
+def _to_copy_csv(records:list[list[Any]])->str:
+    '''
+    Write records as CSV of COPY ... WITH (FORMAT csv), where an unquoted empty field is NULL and "" is an empty string.
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer,quoting=csv.QUOTE_NOTNULL,lineterminator='\n')
+    writer.writerows([[_to_copy_field(val) for val in record] for record in records])
+    return buffer.getvalue()
 
+def _cast_staged(expr:str,sql_type:str)->str:
+    '''
+    Cast a text column of a staging table filled by COPY into sql_type, as CAST of a bound parameter would.
+    '''
+    if sql_type in ('smallint','integer','bigint'): #'1.0' of a float64 column with NaN
+        return f'CAST(CAST({expr} AS numeric) AS {sql_type})'
+    return f'CAST({expr} AS {sql_type})'
 
 _reserved_columns = ['id']
 
+def _convert_pgsql_type_to_pandas_type(pgtype:str,precision:Literal['ns']='ns',
+                                       tz:str|int|tzinfo|None=ZoneInfo('UTC'),
+                                       dtype_backend:Literal['numpy_nullable','pyarrow']='numpy_nullable'):
+    #https://pandas.pydata.org/pandas-docs/stable/user_guide/basics.html#basics-dtypes
+    if dtype_backend == 'pyarrow':
+        return _convert_pgsql_type_to_arrow_type(pgtype,precision,tz)
+    match pgtype:
+        case 'bigint':
+            return pd.Int64Dtype() #Int vs int
+        case 'integer':
+            return pd.Int32Dtype() #Int vs int
+        case 'boolean':
+            return pd.BooleanDtype()
+        case 'text':
+            return pd.StringDtype()
+        case 'double precision':
+            return pd.Float64Dtype()
+        case 'date':
+            return f'datetime64[{precision}]'
+        case 'timestamp without time zone':
+            return f'datetime64[{precision}]'
+        case 'timestamp with time zone':
+            return pd.DatetimeTZDtype(precision,tz=tz)
+        case 'ARRAY':
+            return 'object'
+        case _:
+            raise NotImplementedError(pgtype)
+
+def _convert_pgsql_type_to_arrow_type(pgtype:str,precision:Literal['ns']='ns',
+                                      tz:str|int|tzinfo|None=ZoneInfo('UTC')):
+    #https://pandas.pydata.org/docs/reference/arrays.html#pyarrow
+    import pyarrow as pa
+    match pgtype:
+        case 'bigint':
+            return pd.ArrowDtype(pa.int64())
+        case 'integer':
+            return pd.ArrowDtype(pa.int32())
+        case 'boolean':
+            return pd.ArrowDtype(pa.bool_())
+        case 'text':
+            return pd.ArrowDtype(pa.string())
+        case 'double precision':
+            return pd.ArrowDtype(pa.float64())
+        case 'date':
+            return pd.ArrowDtype(pa.date32())
+        case 'timestamp without time zone':
+            return pd.ArrowDtype(pa.timestamp(precision))
+        case 'timestamp with time zone':
+            return pd.ArrowDtype(pa.timestamp(precision,tz=str(tz)))
+        case 'ARRAY':
+            return 'object'
+        case _:
+            raise NotImplementedError(pgtype)
+
+def _get_pandas_types(df_types:pd.DataFrame,
+                      dtype_backend:Literal['numpy_nullable','pyarrow']='numpy_nullable')->dict[str,Any]:
+    return {column_name:_convert_pgsql_type_to_pandas_type(df_types['data_type'][column_name],dtype_backend=dtype_backend) 
+            for column_name in df_types.index}
+
+def _convert_date_columns(df_content:pd.DataFrame,df_types:pd.DataFrame,
+                          dtype_backend:Literal['numpy_nullable','pyarrow']='numpy_nullable')->pd.DataFrame:
+    #convert date column as datetime64 into date
+    if dtype_backend == 'pyarrow':
+        return df_content #already date32
+    dict_types = df_types.to_dict('index')
+    for column_name in dict_types:
+        match dict_types[column_name]['data_type']:
+            case 'date':
+                if column_name in df_content.columns:
+                    df_content[column_name] = df_content[column_name].dt.date
+    return df_content
+
+
+def _query_identity(conn:sqlalchemy.Connection,schema_name:str,table_name:str)->list[str]:
+    stmt_find_identity = text(f'''
+    SELECT attname as identity_column
+    FROM pg_attribute 
+        JOIN pg_class 
+                ON pg_attribute.attrelid = pg_class.oid
+        JOIN pg_namespace
+                ON pg_class.relnamespace = pg_namespace.oid
+    WHERE nspname = :schema
+        AND relname = :table
+        AND attidentity = 'a';
+    ''')
+    result = conn.execute(stmt_find_identity,{"schema":schema_name,"table":table_name})
+    return [row.identity_column for row in result]
+
+def _query_types(conn:sqlalchemy.Connection,schema_name:str,table_name:str)->pd.DataFrame:
+    stmt_get_types = text(f'''
+    SELECT column_name,
+        column_default,
+        data_type,
+        CASE 
+            WHEN domain_name IS NOT NULL THEN domain_name
+            ELSE data_type
+        END AS display_type,
+        is_generated
+    FROM information_schema.columns
+    WHERE table_schema = :schema
+        AND table_name = :table
+    ORDER BY ordinal_position;
+    ''')
+    return (
+        pd.read_sql_query(sql=stmt_get_types,con=conn,params={"schema":schema_name,"table":table_name})
+        .set_index('column_name')
+    )
+
+def _query_foreign(conn:sqlalchemy.Connection,schema_name:str,table_name:str)->dict[str,tuple[str,str]]:
+    stmt_foreign = text(f'''
+    SELECT DISTINCT KCU.column_name AS current_column_name,
+        CCU.table_schema AS upper_schema, 
+        CCU.table_name AS upper_table
+    FROM information_schema.key_column_usage AS KCU
+        JOIN information_schema.constraint_column_usage AS CCU 
+                ON KCU.constraint_name = CCU.constraint_name
+        JOIN information_schema.table_constraints AS TC 
+                ON KCU.constraint_name = TC.constraint_name
+    WHERE TC.constraint_type = 'FOREIGN KEY'
+        AND KCU.table_schema=:schema
+        AND KCU.table_name=:table;
+    ''')
+    result = conn.execute(stmt_foreign,{"schema":schema_name,"table":table_name})
+    return {row.current_column_name:(row.upper_schema,row.upper_table) for row in result}
+
+def _query_sql_types(conn:sqlalchemy.Connection,schema_name:str,table_name:str)->dict[str,str]:
+    stmt_sql_types = text(f'''
+    SELECT attname AS column_name,
+        format_type(atttypid,atttypmod) AS sql_type
+    FROM pg_attribute 
+        JOIN pg_class 
+                ON pg_attribute.attrelid = pg_class.oid
+        JOIN pg_namespace
+                ON pg_class.relnamespace = pg_namespace.oid
+    WHERE nspname = :schema
+        AND relname = :table
+        AND attnum > 0
+        AND NOT attisdropped;
+    ''')
+    result = conn.execute(stmt_sql_types,{"schema":schema_name,"table":table_name})
+    return {row.column_name:row.sql_type for row in result}
+
+def _query_schema_graph(conn:sqlalchemy.Connection,schema_name:str|None=None)->'SchemaGraph':
+    #the same columns as information_schema.columns read by _query_types
+    stmt_columns = text(f'''
+    SELECT nspname AS schema_name,
+        relname AS table_name,
+        attname AS column_name,
+        pg_get_expr(adbin,adrelid) AS column_default,
+        CASE
+            WHEN t.typtype = 'd' THEN
+                CASE
+                    WHEN bt.typelem <> 0 AND bt.typlen = -1 THEN 'ARRAY'
+                    WHEN bt.typnamespace = 'pg_catalog'::regnamespace THEN format_type(t.typbasetype,NULL)
+                    ELSE 'USER-DEFINED'
+                END
+            WHEN t.typelem <> 0 AND t.typlen = -1 THEN 'ARRAY'
+            WHEN t.typnamespace = 'pg_catalog'::regnamespace THEN format_type(atttypid,NULL)
+            ELSE 'USER-DEFINED'
+        END AS data_type,
+        CASE WHEN t.typtype = 'd' THEN t.typname END AS domain_name,
+        CASE WHEN attgenerated <> '' THEN 'ALWAYS' ELSE 'NEVER' END AS is_generated,
+        format_type(atttypid,atttypmod) AS sql_type,
+        attidentity = 'a' AS is_identity
+    FROM pg_attribute
+        JOIN pg_class
+                ON pg_attribute.attrelid = pg_class.oid
+        JOIN pg_namespace
+                ON pg_class.relnamespace = pg_namespace.oid
+        JOIN pg_type AS t
+                ON atttypid = t.oid
+        LEFT JOIN pg_type AS bt
+                ON t.typbasetype = bt.oid
+        LEFT JOIN pg_attrdef
+                ON adrelid = attrelid AND adnum = attnum AND attgenerated = ''
+    WHERE relkind IN ('r','p')
+        AND attnum > 0
+        AND NOT attisdropped
+        AND (CAST(:schema AS text) IS NULL OR nspname = :schema)
+        AND nspname NOT LIKE 'pg\\_%'
+        AND nspname <> 'information_schema'
+    ORDER BY nspname, relname, attnum;
+    ''')
+    stmt_foreign = text(f'''
+    SELECT ns.nspname AS schema_name,
+        cl.relname AS table_name,
+        attname AS current_column_name,
+        upper_ns.nspname AS upper_schema,
+        upper_cl.relname AS upper_table
+    FROM pg_constraint
+        JOIN pg_class AS cl
+                ON conrelid = cl.oid
+        JOIN pg_namespace AS ns
+                ON cl.relnamespace = ns.oid
+        JOIN pg_class AS upper_cl
+                ON confrelid = upper_cl.oid
+        JOIN pg_namespace AS upper_ns
+                ON upper_cl.relnamespace = upper_ns.oid
+        JOIN pg_attribute
+                ON attrelid = conrelid AND attnum = conkey[1]
+    WHERE contype = 'f'
+        AND (CAST(:schema AS text) IS NULL OR ns.nspname = :schema)
+    ORDER BY ns.nspname, cl.relname, attnum;
+    ''')
+    tables : dict[tuple[str,str],dict[str,Any]] = {}
+    rows_columns : dict[tuple[str,str],list] = {}
+    for row in conn.execute(stmt_columns,{'schema':schema_name}):
+        rows_columns.setdefault((row.schema_name,row.table_name),[]).append(row)
+    for key,rows in rows_columns.items():
+        df_types = pd.DataFrame({'column_name':[row.column_name for row in rows],
+                                 'column_default':[row.column_default for row in rows],
+                                 'data_type':[row.data_type for row in rows],
+                                 'display_type':[row.domain_name if row.domain_name is not None else row.data_type 
+                                                 for row in rows],
+                                 'is_generated':[row.is_generated for row in rows]}).set_index('column_name')
+        tables[key] = {'identity':[row.column_name for row in rows if row.is_identity],
+                       'types':df_types,
+                       'sql_types':{row.column_name:row.sql_type for row in rows},
+                       'foreign':{}}
+    for row in conn.execute(stmt_foreign,{'schema':schema_name}):
+        if (row.schema_name,row.table_name) in tables:
+            tables[(row.schema_name,row.table_name)]['foreign'][row.current_column_name] = (row.upper_schema,row.upper_table)
+    return SchemaGraph(tables)
+
+class SchemaGraph:
+    '''
+    Identity columns, column types and foreign keys of every table in a schema (or a database) as a graph.
+
+    Tables are (schema_name, table_name) and an edge goes from a table to a table its foreign key refers to.
+
+    Examples
+    --------
+    >>> graph = get_schema_graph(eng,'public')
+    >>> graph.load_order() #referred tables first
+    >>> graph.find_cycle()
+    '''
+    tables : dict[tuple[str,str],dict[str,Any]]
+
+    def __init__(self,tables:dict[tuple[str,str],dict[str,Any]]):
+        self.tables = tables
+
+    def get_foreign(self,schema_name:str,table_name:str)->dict[str,tuple[str,str]]:
+        return self.tables[(schema_name,table_name)]['foreign'].copy()
+
+    def get_edges(self)->list[tuple[tuple[str,str],str,tuple[str,str]]]:
+        '''
+        Every foreign key as (table, column, referred table).
+        '''
+        return [(key,col,foreign) for key in self.tables for col,foreign in self.tables[key]['foreign'].items()]
+
+    def get_referred(self,schema_name:str,table_name:str)->set[tuple[str,str]]:
+        '''
+        Tables which the table refers to directly or through other tables, without itself.
+        '''
+        found : set[tuple[str,str]] = set()
+        stack = [(schema_name,table_name)]
+        while len(stack) > 0:
+            key = stack.pop()
+            for foreign in self.tables.get(key,{'foreign':{}})['foreign'].values():
+                if foreign not in found:
+                    found.add(foreign)
+                    stack.append(foreign)
+        found.discard((schema_name,table_name))
+        return found
+
+    def get_dependents(self,schema_name:str,table_name:str)->set[tuple[str,str]]:
+        '''
+        Tables which refer to the table directly or through other tables, without itself.
+        '''
+        return {key for key in self.tables if (schema_name,table_name) in self.get_referred(*key)} - {(schema_name,table_name)}
+
+    def _sorter(self,tables:Iterable[tuple[str,str]]|None=None)->graphlib.TopologicalSorter:
+        sorter = graphlib.TopologicalSorter()
+        if tables is None:
+            for key in self.tables:
+                sorter.add(key,*[foreign for foreign in self.tables[key]['foreign'].values() if foreign != key])
+        else:
+            tables = set(tables)
+            for key in tables:
+                sorter.add(key,*[foreign for foreign in self.get_referred(*key) if foreign in tables])
+        return sorter
+
+    def load_order(self,tables:Iterable[tuple[str,str]]|None=None)->list[tuple[str,str]]:
+        '''
+        Tables ordered so that every table comes after the tables it refers to. Self-references are ignored.
+
+        Parameters
+        ----------
+        tables : Iterable[tuple[str,str]] | None
+            Order only these tables, by foreign keys through other tables too. Every table by default.
+
+        Raises
+        ------
+        graphlib.CycleError
+            If foreign keys make a cycle between tables.
+        '''
+        return list(self._sorter(tables).static_order())
+
+    def find_cycle(self)->list[tuple[str,str]]|None:
+        '''
+        A cycle of foreign keys between tables such as [a, b, a], or None. Self-references are ignored.
+        '''
+        try:
+            self._sorter().prepare()
+        except graphlib.CycleError as err:
+            return err.args[1]
+        return None
+
+def _get_copy_from(conn:sqlalchemy.Connection)->Callable[[str,list[list[Any]]],None]|None:
+    '''
+    Get a function which runs COPY ... FROM STDIN WITH (FORMAT csv) with records on a connection, or None if the driver cannot copy.
+    '''
+    cursor = conn.connection.cursor()
+    if hasattr(cursor,'copy_expert'): #psycopg2
+        def copy(sql:str,records:list[list[Any]]):
+            cursor.copy_expert(sql,io.StringIO(_to_copy_csv(records)))
+    elif hasattr(cursor,'copy'): #psycopg
+        def copy(sql:str,records:list[list[Any]]):
+            with cursor.copy(sql) as cp:
+                cp.write(_to_copy_csv(records))
+    else:
+        return None
+    return copy
+
+class CatalogCache:
+    '''
+    Catalog metadata (identity columns, column types and foreign keys) of tables in one engine.
+
+    An entry is filled on first use and kept until a DDL method of TableStructure invalidates it,
+    ttl seconds pass, or refresh() is called.
+
+    Parameters
+    ----------
+    ttl : float | None
+        Seconds an entry stays valid. None keeps entries until invalidated.
+    '''
+    ttl : float|None
+
+    def __init__(self,ttl:float|None=None):
+        self.ttl = ttl
+        self._entries : dict[tuple[str,str],dict[str,tuple[float,Any]]] = {}
+        self._lock = threading.RLock()
+
+    def get[T](self,schema_name:str,table_name:str,key:str,loader:Callable[[],T])->T:
+        with self._lock:
+            entry = self._entries.get((schema_name,table_name),{})
+            if key in entry:
+                loaded_at, val = entry[key]
+                if self.ttl is None or time.monotonic()-loaded_at < self.ttl:
+                    return val
+        val = loader()
+        self.put(schema_name,table_name,key,val)
+        return val
+
+    def put(self,schema_name:str,table_name:str,key:str,val:Any):
+        with self._lock:
+            self._entries.setdefault((schema_name,table_name),{})[key] = (time.monotonic(),val)
+
+    def invalidate(self,schema_name:str,table_name:str):
+        with self._lock:
+            self._entries.pop((schema_name,table_name),None)
+            self._entries.pop(('',''),None) #the graph of the database
+
+    def refresh(self):
+        '''
+        Drop every entry so that the next use reads the catalog again.
+        '''
+        with self._lock:
+            self._entries.clear()
+
+_catalog_caches : weakref.WeakKeyDictionary[sqlalchemy.Engine,CatalogCache] = weakref.WeakKeyDictionary()
+_catalog_caches_lock = threading.Lock()
+
+def get_catalog_cache(engine:sqlalchemy.Engine)->CatalogCache:
+    '''
+    Get the catalog cache shared by every TableStructure of an engine.
+
+    Examples
+    --------
+    >>> get_catalog_cache(eng).ttl = 60.0
+    >>> get_catalog_cache(eng).refresh()
+    '''
+    with _catalog_caches_lock:
+        if engine not in _catalog_caches:
+            _catalog_caches[engine] = CatalogCache()
+        return _catalog_caches[engine]
+
+def get_schema_graph(engine:sqlalchemy.Engine,schema_name:str|None=None)->SchemaGraph:
+    '''
+    Read identity columns, column types and foreign keys of every table in a schema, or in the database if schema_name is None,
+    in two pg_catalog queries.
+
+    They also fill the catalog cache so that TableStructure of those tables does not query the catalog again.
+
+    Examples
+    --------
+    >>> get_schema_graph(eng,'public').load_order()
+    '''
+    with engine.connect() as conn:
+        graph = _query_schema_graph(conn,schema_name)
+    cache = get_catalog_cache(engine)
+    for (schema_name_table,table_name),entry in graph.tables.items():
+        for key,val in entry.items():
+            cache.put(schema_name_table,table_name,key,val)
+    return graph
+
+def _get_cached_graph(engine:sqlalchemy.Engine,*tables:tuple[str,str])->SchemaGraph:
+    '''
+    The schema graph of the database kept in the catalog cache, read again if it lacks one of tables.
+    '''
+    cache = get_catalog_cache(engine)
+    graph = cache.get('','','graph',lambda: get_schema_graph(engine))
+    if any(key not in graph.tables for key in tables):
+        graph = get_schema_graph(engine)
+        cache.put('','','graph',graph)
+    return graph
+
+class StatementStats:
+    '''
+    Counts of statements run on an engine and how many reused a compiled statement of SQLAlchemy.
+
+    Drivers such as psycopg 3 also prepare a statement on the server once the same text repeats,
+    so the hit rate bounds how often plans of PostgreSQL can be reused.
+    '''
+    def __init__(self):
+        self.statements = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self,cache_hit:Any):
+        with self._lock:
+            self.statements += 1
+            match cache_hit:
+                case default_engine.CACHE_HIT:
+                    self.cache_hits += 1
+                case default_engine.CACHE_MISS:
+                    self.cache_misses += 1
+
+    @property
+    def hit_rate(self)->float:
+        total = self.cache_hits+self.cache_misses
+        return self.cache_hits/total if total > 0 else 0.0
+
+    def __repr__(self):
+        return f'StatementStats(statements={self.statements}, cache_hits={self.cache_hits}, cache_misses={self.cache_misses})'
+
+@contextmanager
+def track_statements(engine:sqlalchemy.Engine)->Iterator[StatementStats]:
+    '''
+    Count statements run on engine inside the block.
+
+    Examples
+    --------
+    >>> with track_statements(engine) as stats:
+    >>>     for id_row in ids:
+    >>>         ts.upload(id_row,return_mode='none',color='red')
+    >>> stats.hit_rate
+    '''
+    stats = StatementStats()
+    def after_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+        stats._count(getattr(context,'cache_hit',None))
+    sqlalchemy.event.listen(engine,'after_cursor_execute',after_cursor_execute)
+    try:
+        yield stats
+    finally:
+        sqlalchemy.event.remove(engine,'after_cursor_execute',after_cursor_execute)
+
+class Span:
+    '''
+    A timed part of a TableStructure operation such as 'TableStructure.read_expand', 'catalog',
+    'stage.read_without_foreign', 'fetch' or 'merge'.
+
+    statements, commits, rows and bytes include those of children.
+    '''
+    def __init__(self,name:str,attributes:dict[str,Any],parent:'Span|None'):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.children : list[Span] = []
+        self.statements = 0
+        self.commits = 0
+        self.rows = 0
+        self.bytes = 0
+        self.start = time.perf_counter()
+        self.end : float|None = None
+        self.otel : Any = None
+
+    @property
+    def duration(self)->float:
+        return (self.end if self.end is not None else time.perf_counter())-self.start
+
+    @property
+    def round_trips(self)->int:
+        return self.statements+self.commits
+
+    def walk(self,depth:int=0)->Iterator[tuple[int,'Span']]:
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth+1)
+
+    def __repr__(self):
+        return (f'Span({self.name!r}, duration={self.duration:.6f}, statements={self.statements}, '
+                f'commits={self.commits}, rows={self.rows}, bytes={self.bytes})')
+
+class Profile:
+    '''
+    Spans finished inside profile().
+    '''
+    def __init__(self):
+        self.spans : list[Span] = []
+
+    def on_start(self,span:Span):
+        pass
+
+    def on_end(self,span:Span):
+        if span.parent is None:
+            self.spans.append(span)
+
+    def to_dataframe(self)->pd.DataFrame:
+        '''
+        Every span as a row with its depth in the tree.
+        '''
+        records = [{'depth':depth,'name':span.name,'table':span.attributes.get('table'),
+                    'duration':span.duration,'statements':span.statements,'commits':span.commits,
+                    'round_trips':span.round_trips,'rows':span.rows,'bytes':span.bytes}
+                   for root in self.spans for depth,span in root.walk()]
+        return pd.DataFrame(records,columns=['depth','name','table','duration','statements','commits',
+                                             'round_trips','rows','bytes'])
+
+class _CallbackInstrument:
+    def __init__(self,callback:Callable[[Span],Any]):
+        self.callback = callback
+    def on_start(self,span:Span):
+        pass
+    def on_end(self,span:Span):
+        self.callback(span)
+
+class _OpenTelemetryInstrument:
+    def __init__(self,tracer:Any):
+        self.tracer = tracer
+    def on_start(self,span:Span):
+        from opentelemetry import trace
+        context = trace.set_span_in_context(span.parent.otel) if span.parent is not None and span.parent.otel is not None else None
+        attributes = {key:str(val) for key,val in span.attributes.items()}
+        span.otel = self.tracer.start_span(f'pyplus.{span.name}',context=context,attributes=attributes)
+    def on_end(self,span:Span):
+        if span.otel is None:
+            return
+        span.otel.update_name(f'pyplus.{span.name}') #stages are named when they finish
+        span.otel.set_attributes({'db.statements':span.statements,'db.commits':span.commits,
+                                  'db.rows':span.rows,'db.bytes':span.bytes})
+        span.otel.end()
+
+_instruments : list[Any] = [] #empty means disabled, checked before anything is measured
+_instruments_lock = threading.Lock()
+_current_span : contextvars.ContextVar[Span|None] = contextvars.ContextVar('pyplus_current_span',default=None)
+
+def _count_statement(conn,cursor,statement,parameters,context,executemany):
+    span = _current_span.get()
+    while span is not None:
+        span.statements += 1
+        span = span.parent
+
+def _count_commit(conn):
+    span = _current_span.get()
+    while span is not None:
+        span.commits += 1
+        span = span.parent
+
+def add_instrument(instrument:Any):
+    '''
+    Start calling instrument.on_start(span) and instrument.on_end(span) around TableStructure operations.
+
+    See Also
+    --------
+    profile
+    add_hook
+    enable_opentelemetry
+    '''
+    with _instruments_lock:
+        if len(_instruments) == 0:
+            sqlalchemy.event.listen(sqlalchemy.Engine,'after_cursor_execute',_count_statement)
+            sqlalchemy.event.listen(sqlalchemy.Engine,'commit',_count_commit)
+        _instruments.append(instrument)
+
+def remove_instrument(instrument:Any):
+    with _instruments_lock:
+        if instrument in _instruments:
+            _instruments.remove(instrument)
+        if len(_instruments) == 0 and sqlalchemy.event.contains(sqlalchemy.Engine,'after_cursor_execute',_count_statement):
+            sqlalchemy.event.remove(sqlalchemy.Engine,'after_cursor_execute',_count_statement)
+            sqlalchemy.event.remove(sqlalchemy.Engine,'commit',_count_commit)
+
+def add_hook(callback:Callable[[Span],Any])->Any:
+    '''
+    Call callback with every finished Span. Returns a handle for remove_instrument.
+
+    Examples
+    --------
+    >>> handle = add_hook(lambda span: print(span.name,span.duration,span.statements))
+    >>> remove_instrument(handle)
+    '''
+    instrument = _CallbackInstrument(callback)
+    add_instrument(instrument)
+    return instrument
+
+def enable_opentelemetry(tracer:Any=None)->Any:
+    '''
+    Emit every Span as an OpenTelemetry span. Returns a handle for remove_instrument.
+    '''
+    from opentelemetry import trace
+    instrument = _OpenTelemetryInstrument(tracer if tracer is not None else trace.get_tracer('pyplus.sql'))
+    add_instrument(instrument)
+    return instrument
+
+@contextmanager
+def profile()->Iterator[Profile]:
+    '''
+    Collect spans of TableStructure operations inside the block.
+
+    Examples
+    --------
+    >>> with profile() as prof:
+    ...     ts.upload_dataframe(df)
+    >>> prof.to_dataframe()
+    '''
+    prof = Profile()
+    add_instrument(prof)
+    try:
+        yield prof
+    finally:
+        remove_instrument(prof)
+
+@contextmanager
+def _span(name:str,**attributes:Any)->Iterator[Span|None]:
+    if len(_instruments) == 0:
+        yield None
+        return
+    span = Span(name,attributes,_current_span.get())
+    if span.parent is not None:
+        span.parent.children.append(span)
+    token = _current_span.set(span)
+    for instrument in list(_instruments):
+        instrument.on_start(span)
+    try:
+        yield span
+    finally:
+        span.end = time.perf_counter()
+        _current_span.reset(token)
+        for instrument in list(_instruments):
+            instrument.on_end(span)
+
+def _record_fetch(df_content:pd.DataFrame):
+    if len(_instruments) == 0:
+        return
+    span = _current_span.get()
+    nbytes = int(df_content.memory_usage(index=True).sum())
+    while span is not None:
+        span.rows += len(df_content)
+        span.bytes += nbytes
+        span = span.parent
+
+def _traced[F:Callable](func:F)->F:
+    '''
+    Wrap a public method of TableStructure in a span. Only a check of _instruments is added when disabled.
+    '''
+    name = func.__name__
+    @functools.wraps(func)
+    def wrapper(self,*args,**kwargs):
+        if len(_instruments) == 0:
+            return func(self,*args,**kwargs)
+        with _span(f'{type(self).__name__}.{name}',table=f'{self.schema_name}.{self.table_name}'):
+            return func(self,*args,**kwargs)
+    return wrapper
+
+class TableSnapshot:
+    '''
+    A run of TableStructure._iter_read whose stages are computed once and memoized until invalidate().
+
+    Stages that do not depend on arguments (get_identity, get_types, read_without_foreign) are shared between runs.
+
+    Parameters
+    ----------
+    ts : TableStructure
+        A table to read.
+
+    Examples
+    --------
+    >>> snap = TableSnapshot(ts)
+    >>> df_expanded = snap.read_with_foreign()
+    >>> df_types = snap.get_types_with_foreign() #no more query
+    '''
+    _shared_stages = ('get_identity','get_types','read_without_foreign')
+    _default_args = {'ascending':False,'remove_original_id':False,'expansion':'join','selfref':'wide'}
+    _unkeyed_args = ('executor',)
+
+    def __init__(self,ts:'TableStructure'):
+        self.ts = ts
+        self._runs : dict[tuple,tuple[Any,dict[str,Any]]] = {}
+        self._lock = threading.RLock()
+
+    def invalidate(self):
+        with self._lock:
+            self._runs.clear()
+
+    def _stage(self,stage:str,**kwargs):
+        with self._lock:
+            if stage in self._shared_stages:
+                for _,stages in self._runs.values():
+                    if stage in stages:
+                        return stages[stage].copy()
+            kwargs = self._default_args | kwargs
+            args = tuple(sorted([(key,val) for key,val in kwargs.items() if key not in self._unkeyed_args]))
+            if args not in self._runs:
+                self._runs[args] = (self.ts._iter_read(**kwargs),{})
+            gen, stages = self._runs[args]
+            while stage not in stages:
+                with _span('stage',table=f'{self.ts.schema_name}.{self.ts.table_name}') as span:
+                    val, name = next(gen) if len(stages) == 0 else gen.send(stage)
+                    if span is not None:
+                        span.name = f'stage.{name}'
+                stages[name] = val
+            return stages[stage].copy()
+
+    def get_identity(self)->list[str]:
+        return self._stage('get_identity')
+    def get_types(self)->pd.DataFrame:
+        return self._stage('get_types')
+    def read_without_foreign(self)->pd.DataFrame:
+        return self._stage('read_without_foreign')
+    def get_types_with_foreign(self,remove_original_id=False)->pd.DataFrame:
+        return self._stage('get_types_with_foreign',remove_original_id=remove_original_id)
+    def read_with_foreign(self,ascending=False,remove_original_id=False,
+                          expansion:Literal['join','pandas']='join',
+                          selfref:Literal['wide','path']='wide',executor:Executor|None=None)->pd.DataFrame:
+        return self._stage('read_with_foreign',ascending=ascending,remove_original_id=remove_original_id,
+                           expansion=expansion,selfref=selfref,executor=executor)
+    def addresses(self)->pd.DataFrame:
+        return self._stage('addresses')
+
 class TableStructure:
     '''
     TableStructure is a class that easily operate Create, Read, Update databases especially a table with foreign columns.
+
+    With dtype_backend='pyarrow', reads return Arrow-backed columns (date as date32) and foreign tables follow it.
+
+    repr() and notebooks show preview(repr_rows) with the row count estimated by pg_class.reltuples,
+    or counted exactly if repr_exact_count is True.
     '''
     schema_name : str
     table_name : str
     engine : sqlalchemy.Engine
+    dtype_backend : Literal['numpy_nullable','pyarrow']
+    repr_rows : int = 5
+    repr_exact_count : bool = False
 
     def _get_default_parameter_stmt(self):
         return {"schema":self.schema_name,"table":self.table_name}
 
     def __init__(self,schema_name:str,table_name:str,
-                 engine:sqlalchemy.Engine):
+                 engine:sqlalchemy.Engine,
+                 dtype_backend:Literal['numpy_nullable','pyarrow']='numpy_nullable'):
         self.schema_name = schema_name
         self.table_name = table_name
         self.engine = engine
+        self.dtype_backend = dtype_backend
+        self._snapshot : TableSnapshot|None = None
+        self._incremental : dict[str,tuple[Any,pd.DataFrame]] = {}
+
+    def _catalog[T](self,key:str,query:Callable[[sqlalchemy.Connection,str,str],T])->T:
+        def loader():
+            with _span('catalog',table=f'{self.schema_name}.{self.table_name}',key=key):
+                #one miss reads the whole schema so that its foreign tables are ready too
+                graph = get_schema_graph(self.engine,self.schema_name)
+                if (self.schema_name,self.table_name) in graph.tables:
+                    return graph.tables[(self.schema_name,self.table_name)][key]
+                with self.engine.connect() as conn:
+                    return query(conn,self.schema_name,self.table_name)
+        return get_catalog_cache(self.engine).get(self.schema_name,self.table_name,key,loader)
+
+    def refresh(self):
+        '''
+        Forget cached catalog metadata of this table.
+        '''
+        get_catalog_cache(self.engine).invalidate(self.schema_name,self.table_name)
+        self._invalidate_snapshot()
+        self._incremental.clear()
+        _refresh_lookups(self)
+
+    @contextmanager
+    def snapshot(self):
+        '''
+        Pin a snapshot so that every accessor of this table inside the block reuses one run of the read pipeline.
+
+        Writes through this table and notifications of a ChangeListener invalidate the pinned snapshot.
+
+        Examples
+        --------
+        >>> with ts.snapshot():
+        ...     df = ts.read_expand()
+        ...     df_types = ts.get_types_expanded() #no more query
+        '''
+        if self._snapshot is not None:
+            yield self._snapshot
+            return
+        self._snapshot = TableSnapshot(self)
+        _pinned_tables.add(self)
+        try:
+            yield self._snapshot
+        finally:
+            self._snapshot = None
+            _pinned_tables.discard(self)
+
+    @contextmanager
+    def session(self):
+        '''
+        Buffer edits of this table and flush them in one transaction when the block ends.
+
+        Nothing is written if the block raises.
+
+        See Also
+        --------
+        session
+
+        Examples
+        --------
+        >>> with ts.session() as s:
+        ...     s.upload(1,color='red')
+        ...     s.upload(1,weight=3) #one UPDATE with color and weight
+        ...     s.append(color='green',**{'origin_id.country':'kr'})
+        ...     s.delete_row(2)
+        '''
+        with session(self.engine) as uow:
+            yield uow.table(self)
+
+    def _current_snapshot(self)->TableSnapshot:
+        if self._snapshot is not None:
+            return self._snapshot
+        return TableSnapshot(self)
+
+    def _invalidate_snapshot(self):
+        if self._snapshot is not None:
+            self._snapshot.invalidate()
+
+    def preview(self,n:int=5,ascending=False)->pd.DataFrame:
+        '''
+        Read the first and the last n rows by id with columns of foreign tables.
+
+        Ids are selected by LIMIT and only foreign rows which those rows refer to are read.
+        '''
+        column_identity = self._catalog('identity',_query_identity)[0]
+        stmt = text(f'''
+        (SELECT "{column_identity}" FROM {self.schema_name}.{self.table_name} ORDER BY "{column_identity}" ASC LIMIT :n)
+        UNION
+        (SELECT "{column_identity}" FROM {self.schema_name}.{self.table_name} ORDER BY "{column_identity}" DESC LIMIT :n);
+        ''')
+        with self.engine.connect() as conn:
+            ids = [row[0] for row in conn.execute(stmt,{'n':n})]
+        return self._read_rows_expanded(ids).sort_index(ascending=ascending)
+
+    def count_rows(self,exact=False)->int|None:
+        '''
+        The number of rows estimated by pg_class.reltuples, or by count(*) if exact.
+
+        Returns
+        --------
+        int | None
+            None if the table has never been analyzed and exact is False.
+        '''
+        with self.engine.connect() as conn:
+            if exact:
+                return conn.execute(text(f'SELECT count(*) FROM {self.schema_name}.{self.table_name}')).scalar()
+            estimate = conn.execute(text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)'),
+                                    {'table':f'{self.schema_name}.{self.table_name}'}).scalar()
+        return None if estimate is None or estimate < 0 else int(estimate)
+
+    def _repr_preview(self)->tuple[pd.DataFrame,int|None,str,int|None]:
+        '''
+        Returns
+        --------
+        df_preview, max_rows, count, columns
+            max_rows is given to DataFrame.to_string or to_html, which then shows '...' between the first and the last rows.
+        '''
+        n = self.repr_rows
+        df_preview = self.preview(n+1) #one more row on each side tells if rows are left out
+        if len(df_preview) <= 2*n:
+            return df_preview, None, str(len(df_preview)), len(df_preview.columns)
+        count = self.count_rows(self.repr_exact_count)
+        if count is not None and count <= 2*n:
+            count = self.count_rows(exact=True) #statistics are stale
+        #a hidden row in the middle so that the first n and the last n rows are shown
+        df_preview = pd.concat([df_preview.iloc[:n+1],df_preview.iloc[-n:]])
+        count_text = '?' if count is None else (f'{count}' if self.repr_exact_count else f'~{count}')
+        return df_preview, 2*n, count_text, len(df_preview.columns)
 
     def __repr__(self):
-        ret = f'{self.schema_name}.{self.table_name}'
-        ret += repr(chpo.CheckPointFunction(self._iter_read).read_with_foreign())
+        df_preview, max_rows, count, columns = self._repr_preview()
+        ret = f'{self.schema_name}.{self.table_name}\n'
+        ret += df_preview.to_string(max_rows=max_rows,min_rows=max_rows,show_dimensions=False)
+        ret += f'\n\n[{count} rows x {columns} columns]'
+        return ret
+
+    def _repr_html_(self):
+        df_preview, max_rows, count, columns = self._repr_preview()
+        ret = f'<p>{self.schema_name}.{self.table_name}</p>'
+        ret += df_preview.to_html(max_rows=max_rows,show_dimensions=False)
+        ret += f'<p>{count} rows × {columns} columns</p>'
         return ret
 
     #Creation
+    @_traced
     def append_column(self,**type_dict):
         for rc in _reserved_columns:
             if rc in type_dict:
                 raise ValueError(f'{rc} is reserved.')
         
+        if len(type_dict) == 0:
+            return
+        clauses = ','.join([f'ADD COLUMN "{key}" {type_dict[key]}' for key in type_dict])
         with self.engine.connect() as conn:
-            for key in type_dict:
-                query = text(f'ALTER TABLE IF EXISTS {self.schema_name}.{self.table_name} ADD COLUMN "{key}" {type_dict[key]};')
-                conn.execute(query)
+            query = text(f'ALTER TABLE IF EXISTS {self.schema_name}.{self.table_name} {clauses};')
+            conn.execute(query)
             conn.commit()
+        self.refresh()
             
     
     #Read
-    def _execute_to_pandas(self,stmt,stmt_columns):
-        with self.engine.connect() as conn:
-            result = conn.execute(stmt,self._get_default_parameter_stmt())
-            
-            return pd.DataFrame([[getattr(row,col) for col in stmt_columns] for row in result],columns=stmt_columns)
-        
     def get_foreign_tables(self)->dict[str,Self]:
-        stmt_foreign_col=['current_column_name','upper_schema','upper_table']
-        stmt_foreign = text(f'''
-        SELECT KCU.column_name AS {stmt_foreign_col[0]},
-            CCU.table_schema AS {stmt_foreign_col[1]}, 
-            CCU.table_name AS {stmt_foreign_col[2]}
-        FROM information_schema.key_column_usage AS KCU
-            JOIN information_schema.constraint_column_usage AS CCU 
-                    ON KCU.constraint_name = CCU.constraint_name
-            JOIN information_schema.table_constraints AS TC 
-                    ON KCU.constraint_name = TC.constraint_name
-        WHERE TC.constraint_type = 'FOREIGN KEY'
-            AND KCU.table_schema=:schema
-            AND KCU.table_name=:table;
-        ''')
-        df_types = (
-            self
-            ._execute_to_pandas(stmt_foreign,stmt_foreign_col)
-            .drop_duplicates()
-            .to_dict('records')
-        )
-        ret = {val['current_column_name']:
-               TableStructure(val['upper_schema'],val['upper_table'],self.engine) 
-               for val in df_types}
+        foreign = self._catalog('foreign',_query_foreign)
+        ret = {col:TableStructure(foreign[col][0],foreign[col][1],self.engine,self.dtype_backend) 
+               for col in foreign}
         return ret.copy()
     
     def check_if_not_local_column(self,column:str)->bool:
@@ -134,135 +1060,499 @@ class TableStructure:
         else:
             return False
     
-    def _iter_read(self,ascending=False,remove_original_id=False):
-        stmt_find_identity = text(f'''
-        SELECT attname as identity_column
-        FROM pg_attribute 
-            JOIN pg_class 
-                    ON pg_attribute.attrelid = pg_class.oid
-            JOIN pg_namespace
-                    ON pg_class.relnamespace = pg_namespace.oid
-        WHERE nspname = :schema
-            AND relname = :table
-            AND attidentity = 'a';
-        ''')
-        with self.engine.connect() as conn:
-            result = conn.execute(stmt_find_identity,self._get_default_parameter_stmt())
-            column_identity = [row.identity_column for row in result]
-        yield column_identity, 'get_identity'
+    def _read_sql_options(self)->dict[str,Any]:
+        #pyarrow builds Arrow arrays from rows directly, the default keeps arrays in object columns as they are
+        return {'dtype_backend':'pyarrow'} if self.dtype_backend == 'pyarrow' else {}
 
-        stmt_get_types = text(f'''
-        SELECT column_name,
-            column_default,
-            data_type,
-            CASE 
-                WHEN domain_name IS NOT NULL THEN domain_name
-                ELSE data_type
-            END AS display_type,
-            is_generated
-        FROM information_schema.columns
-        WHERE table_schema = '{self.schema_name}'
-            AND table_name = '{self.table_name}';
-        ''')
-        with self.engine.connect() as conn:
-            df_types = (
-                pd.read_sql_query(sql=stmt_get_types,con=conn)
-                .set_index('column_name')
-            )
-        yield df_types.copy(), 'get_types'
-
-        def _convert_pgsql_type_to_pandas_type(pgtype:str,precision:Literal['ns']='ns',
-                                            tz:str|int|tzinfo|None=ZoneInfo('UTC')):
-            #https://pandas.pydata.org/pandas-docs/stable/user_guide/basics.html#basics-dtypes
-            match pgtype:
-                case 'bigint':
-                    return pd.Int64Dtype() #Int vs int
-                case 'integer':
-                    return pd.Int32Dtype() #Int vs int
-                case 'boolean':
-                    return pd.BooleanDtype()
-                case 'text':
-                    return pd.StringDtype()
-                case 'double precision':
-                    return pd.Float64Dtype()
-                case 'date':
-                    return f'datetime64[{precision}]'
-                case 'timestamp without time zone':
-                    return f'datetime64[{precision}]'
-                case 'timestamp with time zone':
-                    return pd.DatetimeTZDtype(precision,tz=tz)
-                case 'ARRAY':
-                    return 'object'
-                case _:
-                    raise NotImplementedError(pgtype)
+    def _read_typed(self,conn:sqlalchemy.Connection,stmt,params:dict[str,Any]|None=None,
+                    chunksize:int|None=None)->pd.DataFrame|Iterator[pd.DataFrame]:
+        '''
+        Run a statement returning rows of this table and convert them into the dtypes of read().
+        '''
+        column_identity = self._catalog('identity',_query_identity)
+        df_types = self._catalog('types',_query_types)
+        def convert(df_chunk:pd.DataFrame)->pd.DataFrame:
+            _record_fetch(df_chunk)
+            return _convert_date_columns(df_chunk,df_types,self.dtype_backend)
+        with _span('fetch',table=f'{self.schema_name}.{self.table_name}'):
+            df_content = pd.read_sql_query(sql=stmt,con=conn,params=params,chunksize=chunksize,
+                                           dtype=_get_pandas_types(df_types,self.dtype_backend),index_col=column_identity,
+                                           **self._read_sql_options())
+            if chunksize is None:
+                return convert(df_content)
+        return (convert(df_chunk) for df_chunk in df_content)
 
-        conv_type = {column_name:_convert_pgsql_type_to_pandas_type(df_types['data_type'][column_name]) 
-                    for column_name in df_types.index}
+    def _is_selfref(self,ts:Self)->bool:
+        match (ts.schema_name,ts.table_name):
+            case (self.schema_name,self.table_name):
+                return True
+            case _:
+                return False
 
-        sql_content = text(f'SELECT * FROM {self.schema_name}.{self.table_name}')
-        with self.engine.connect() as conn:
-            df_content = pd.read_sql_query(sql=sql_content,con=conn,dtype=conv_type,index_col=column_identity)
-        
-        #convert date column as datetime64 into date
-        dict_types = df_types.to_dict('index')
-        for column_name in dict_types:
-            match dict_types[column_name]['data_type']:
-                case 'date':
-                    df_content[column_name] = df_content[column_name].dt.date
-        
-        yield df_content.copy(), 'read_without_foreign'
-        
-        def check_selfref_table(ts:Self)->bool:
-            match (ts.schema_name,ts.table_name):
-                case (self.schema_name,self.table_name):
-                    return True
-                case _:
-                    return False
-        
-        foreign_tables_ts =self.get_foreign_tables() 
+    def _has_selfref(self)->bool:
+        foreign_tables_ts = self.get_foreign_tables()
+        return any([self._is_selfref(foreign_tables_ts[col]) for col in foreign_tables_ts])
+
+    def _get_types_with_foreign(self,remove_original_id=False,
+                                path:frozenset[tuple[str,str]]=frozenset())->pd.DataFrame:
+        df_types = self._catalog('types',_query_types)
+        foreign_tables_ts = self.get_foreign_tables()
+        path = path | {(self.schema_name,self.table_name)}
         for col_local_foreign in foreign_tables_ts:
-            if not check_selfref_table(foreign_tables_ts[col_local_foreign]):
-                ts = foreign_tables_ts[col_local_foreign]
-                df_ftable_types=ts.get_types_expanded()
+            ts = foreign_tables_ts[col_local_foreign]
+            if not self._is_selfref(ts):
+                if (ts.schema_name,ts.table_name) in path:
+                    raise NotImplementedError(f'Circular foreign keys through {ts.schema_name}.{ts.table_name}.')
+                df_ftable_types=ts._get_types_with_foreign(path=path)
                 row_changer={row:f'{col_local_foreign}.{row}' for row in df_ftable_types.index.to_list()}
                 df_ftable_types=df_ftable_types.rename(index=row_changer)
                 df_types = pd.concat([df_types,df_ftable_types])
                 if remove_original_id:
                     df_types = df_types.drop(index=col_local_foreign)
+        return df_types
+
+    def _compile_expansion(self):
+        '''
+        Compile foreign tables into LEFT JOINs on this table aliased as t0.
+
+        A foreign table with a self-referencing column cannot be joined in a fixed depth,
+        so it is read by its own read_expand and merged in pandas.
+
+        Returns
+        --------
+        selects : list[tuple[str,str,str]]
+            (expression, column, data_type) to select.
+        joins : list[str]
+            JOIN clauses.
+        merges : list[tuple[str,TableStructure]]
+            (column of a foreign id, foreign table) to merge after joins.
+        order : list[str|int]
+            Expanded columns in the order of read_expand. An int is a position of merges.
+        '''
+        selects : list[tuple[str,str,str]] = []
+        joins : list[str] = []
+        merges : list[tuple[str,TableStructure]] = []
+        order : list[str|int] = []
+        def visit(ts:TableStructure,alias:str,prefix:str,path:set[tuple[str,str]]):
+            foreign_tables_ts = ts.get_foreign_tables()
+            for col_local_foreign in foreign_tables_ts:
+                ft = foreign_tables_ts[col_local_foreign]
+                if ts._is_selfref(ft):
+                    continue
+                key = f'{prefix}{col_local_foreign}'
+                if ft._has_selfref():
+                    merges.append((key,ft))
+                    order.append(len(merges)-1)
+                    continue
+                if (ft.schema_name,ft.table_name) in path:
+                    raise NotImplementedError(f'Circular foreign keys through {ft.schema_name}.{ft.table_name}.')
+
+                ft_alias = f't{len(joins)+1}'
+                ft_identity = ft._catalog('identity',_query_identity)
+                joins.append(f'''LEFT JOIN {ft.schema_name}.{ft.table_name} AS {ft_alias}
+                ON {ft_alias}."{ft_identity[0]}" = {alias}."{col_local_foreign}"''')
+                ft_types = ft._catalog('types',_query_types)
+                for col in ft_types.index:
+                    if col not in ft_identity:
+                        selects.append((f'{ft_alias}."{col}"',f'{key}.{col}',ft_types['data_type'][col]))
+                        order.append(f'{key}.{col}')
+                visit(ft,ft_alias,f'{key}.',path|{(ft.schema_name,ft.table_name)})
+        visit(self,'t0','',{(self.schema_name,self.table_name)})
+        return selects,joins,merges,order
+
+    def _compile_select(self,include_local=False):
+        '''
+        Compile a SELECT of this table joined with foreign tables.
+
+        Returns
+        --------
+        stmt : str
+            SELECT statement whose columns are aliased as c0 (identity), c1, c2,...
+        entries : list[tuple[str,str,str]]
+            (expression, column, data_type) of c0, c1, c2,...
+        merges, order
+            See _compile_expansion.
+        '''
+        selects,joins,merges,order = self._compile_expansion()
+        column_identity = self._catalog('identity',_query_identity)
+        df_types = self._catalog('types',_query_types)
+
+        entries = [(f't0."{column_identity[0]}"',column_identity[0],df_types['data_type'][column_identity[0]])]
+        if include_local:
+            entries += [(f't0."{col}"',col,df_types['data_type'][col]) 
+                        for col in df_types.index if col not in column_identity]
+        entries += selects
+        select_list = ','.join([f'{expr} AS c{num}' for num,(expr,_,_) in enumerate(entries)])
+        stmt = f'''
+        SELECT {select_list}
+        FROM {self.schema_name}.{self.table_name} AS t0
+        {' '.join(joins)}
+        '''
+        return stmt,entries,merges,order
+
+    def _read_selected(self,conn:sqlalchemy.Connection,stmt,entries:list[tuple[str,str,str]],
+                       params:dict[str,Any]|None=None,chunksize:int|None=None)->pd.DataFrame|Iterator[pd.DataFrame]:
+        dtypes = {f'c{num}':_convert_pgsql_type_to_pandas_type(data_type,dtype_backend=self.dtype_backend) 
+                  for num,(_,_,data_type) in enumerate(entries)}
+        def convert(df_selected:pd.DataFrame)->pd.DataFrame:
+            _record_fetch(df_selected)
+            for num,(_,_,data_type) in enumerate(entries):
+                if num > 0 and data_type == 'date' and self.dtype_backend != 'pyarrow':
+                    df_selected[f'c{num}'] = df_selected[f'c{num}'].dt.date
+            df_selected = df_selected.rename(columns={f'c{num}':col for num,(_,col,_) in enumerate(entries)})
+            df_selected.index.name = entries[0][1]
+            return df_selected
+        with _span('fetch',table=f'{self.schema_name}.{self.table_name}'):
+            df_selected = pd.read_sql_query(sql=stmt,con=conn,params=params,dtype=dtypes,index_col='c0',chunksize=chunksize,
+                                            **self._read_sql_options())
+            if chunksize is None:
+                return convert(df_selected)
+        return (convert(df_chunk) for df_chunk in df_selected)
+
+    def _read_foreign_tables(self,tables:Iterable[Self],ascending=False,expansion:Literal['join','pandas']='join',
+                             executor:Executor|None=None)->dict[tuple[str,str],pd.DataFrame]:
+        '''
+        Read every distinct table once, in parallel on executor if given.
+        '''
+        distinct = {(ft.schema_name,ft.table_name):ft for ft in tables}
+        def fetch(ft:TableStructure)->pd.DataFrame:
+            return TableSnapshot(ft).read_with_foreign(ascending=ascending,expansion=expansion)
+        mapper = map if executor is None else executor.map
+        return dict(zip(distinct,mapper(fetch,distinct.values())))
+
+    def _read_merges(self,merges:list[tuple[str,Self]],ascending=False,executor:Executor|None=None)->list[pd.DataFrame]:
+        df_ftables = self._read_foreign_tables([ft for _,ft in merges],ascending,executor=executor)
+        df_merges = []
+        for key,ft in merges:
+            df_ftable = df_ftables[(ft.schema_name,ft.table_name)]
+            column_changer={col:f'{key}.{col}' for col in df_ftable.columns.to_list()}
+            df_merges.append(df_ftable.rename(columns=column_changer))
+        return df_merges
+
+    def _read_merges_referred(self,df_content:pd.DataFrame,merges:list[tuple[str,Self]])->list[pd.DataFrame]:
+        '''
+        Like _read_merges but read only rows of foreign tables which df_content refers to.
+        '''
+        df_merges = []
+        for key,ft in merges:
+            df_ftable = ft._read_rows_expanded(df_content[key].dropna().unique().tolist())
+            df_merges.append(df_ftable.rename(columns={col:f'{key}.{col}' for col in df_ftable.columns.to_list()}))
+        return df_merges
+
+    def _merge_foreign(self,df_content:pd.DataFrame,merges:list[tuple[str,Self]],order:list[str|int],
+                       df_merges:list[pd.DataFrame])->tuple[pd.DataFrame,dict[str,list[str]]]:
+        for (key,_),df_ftable in zip(merges,df_merges):
+            df_content = pd.merge(df_content,df_ftable,'left',left_on=key,right_index=True)
+
+        foreign_columns : dict[str,list[str]] = {}
+        for item in order:
+            match item:
+                case int():
+                    columns = df_merges[item].columns.to_list()
+                case str():
+                    columns = [item]
+            for col in columns:
+                foreign_columns.setdefault(col.split('.')[0],[]).append(col)
+        return df_content, foreign_columns
+
+    def _assemble_expanded(self,df_content:pd.DataFrame,foreign_columns:dict[str,list[str]],remove_original_id=False,
+                           selfref:Literal['wide','path']='wide',ids:list[int]|None=None,
+                           stop_at:str|None=None)->pd.DataFrame:
+        '''
+        Order joined columns like read_expand(expansion='pandas') and expand self-referencing columns.
+
+        If ids is given, df_content holds only those rows. Expansion stops before a self-referencing column stop_at.
+        '''
+        column_identity = self._catalog('identity',_query_identity)
+        df_types = self._catalog('types',_query_types)
+        columns = [col for col in df_types.index if col not in column_identity]
+        foreign_tables_ts = self.get_foreign_tables()
+        for col_local_foreign in foreign_tables_ts:
+            if not self._is_selfref(foreign_tables_ts[col_local_foreign]):
+                columns += foreign_columns.get(col_local_foreign,[])
+                if remove_original_id:
+                    columns.remove(col_local_foreign)
+            else:
+                if col_local_foreign == stop_at:
+                    break
+                lookup = None
+                if ids is not None:
+                    def lookup(ids_ancestor:list[int],stop_at=col_local_foreign):
+                        return self._read_rows_expanded(ids_ancestor,remove_original_id,selfref,stop_at)
+                df_selfref = self._expand_selfref(df_content[columns],col_local_foreign,selfref,ids,lookup)
+                columns_selfref = df_selfref.columns.to_list()[len(columns):]
+                df_content = df_content.join(df_selfref[columns_selfref])
+                columns += columns_selfref
+        return df_content[columns]
+
+    def _read_rows_expanded(self,ids:list[int],remove_original_id=False,selfref:Literal['wide','path']='wide',
+                            stop_at:str|None=None)->pd.DataFrame:
+        column_identity = self._catalog('identity',_query_identity)
+        ids = [_to_db_param(id_row) for id_row in ids]
+        return self._read_where_expanded(f't0."{column_identity[0]}" = ANY(:ids)',{'ids':ids},
+                                         remove_original_id,selfref,stop_at,ids)
+
+    def _read_where_expanded(self,condition:str,params:dict[str,Any],remove_original_id=False,
+                             selfref:Literal['wide','path']='wide',stop_at:str|None=None,
+                             ids:list[int]|None=None)->pd.DataFrame:
+        '''
+        Read rows of this table aliased as t0 which satisfy condition, with columns of foreign tables.
+        Only rows of merged foreign tables and ancestors of a self-referencing column which those rows refer to are read.
+        '''
+        stmt,entries,merges,order = self._compile_select(include_local=True)
+        with self.engine.connect() as conn:
+            df_content = self._read_selected(conn,text(f'{stmt} WHERE {condition}'),entries,params)
+        ids = df_content.index.to_list() if ids is None else ids
+        df_content, foreign_columns = self._merge_foreign(df_content,merges,order,self._read_merges_referred(df_content,merges))
+        return self._assemble_expanded(df_content,foreign_columns,remove_original_id,selfref,ids,stop_at)
+
+    def _compile_paths(self,paths:list[str])->tuple[dict[str,tuple[str,str]],list[str]]:
+        '''
+        Compile columns such as 'color' or 'fruit_id.origin_id.country' into the least LEFT JOINs on this table aliased as t0.
+
+        Returns
+        --------
+        resolved : dict[str,tuple[str,str]]
+            (expression, data_type) by column.
+        joins : list[str]
+            JOIN clauses.
+        '''
+        joins : list[str] = []
+        aliases : dict[str,tuple[str,TableStructure]] = {'':('t0',self)}
+        resolved : dict[str,tuple[str,str]] = {}
+        for path in paths:
+            parts = path.split('.')
+            alias, ts = aliases['']
+            key = ''
+            for part in parts[:-1]:
+                foreign_tables_ts = ts.get_foreign_tables()
+                if part not in foreign_tables_ts:
+                    raise KeyError(f'{path} is not a column.')
+                key = f'{key}.{part}' if key else part
+                if key not in aliases:
+                    ft = foreign_tables_ts[part]
+                    ft_alias = f't{len(aliases)}'
+                    ft_identity = ft._catalog('identity',_query_identity)
+                    joins.append(f'''LEFT JOIN {ft.schema_name}.{ft.table_name} AS {ft_alias}
+                    ON {ft_alias}."{ft_identity[0]}" = {alias}."{part}"''')
+                    aliases[key] = (ft_alias,ft)
+                alias, ts = aliases[key]
+            df_types = ts._catalog('types',_query_types)
+            if parts[-1] not in df_types.index:
+                raise KeyError(f'{path} is not a column.')
+            resolved[path] = (f'{alias}."{parts[-1]}"',df_types['data_type'][parts[-1]])
+        return resolved,joins
+
+    def _read_pushdown(self,columns:list[str],filters:dict[str,Any]|None=None,order_by:str|list[str]|None=None,
+                       ascending=False,limit:int|None=None,offset:int|None=None)->pd.DataFrame:
+        column_identity = self._catalog('identity',_query_identity)
+        filters = {} if filters is None else filters
+        order_by = [] if order_by is None else ([order_by] if isinstance(order_by,str) else list(order_by))
+        resolved,joins = self._compile_paths(list(dict.fromkeys([column_identity[0],*columns,*filters,*order_by])))
+
+        conditions = []
+        params : dict[str,Any] = {}
+        for num,col in enumerate(filters):
+            expr = resolved[col][0]
+            match filters[col]:
+                case None:
+                    conditions.append(f'{expr} IS NULL')
+                case slice(start=start,stop=stop):
+                    if start is not None:
+                        conditions.append(f'{expr} >= :f{num}_start')
+                        params[f'f{num}_start'] = _to_db_param(start)
+                    if stop is not None:
+                        conditions.append(f'{expr} < :f{num}_stop')
+                        params[f'f{num}_stop'] = _to_db_param(stop)
+                case list()|tuple()|set()|frozenset()|np.ndarray()|pd.Series()|pd.Index():
+                    conditions.append(f'{expr} = ANY(:f{num})')
+                    params[f'f{num}'] = _to_db_param(list(filters[col]))
+                case val:
+                    conditions.append(f'{expr} = :f{num}')
+                    params[f'f{num}'] = _to_db_param(val)
+        direction = 'ASC' if ascending else 'DESC'
+        orders = [f'{resolved[col][0]} {direction}' for col in order_by]+[f't0."{column_identity[0]}" {direction}']
+        sql_limit = ''
+        if limit is not None:
+            sql_limit += ' LIMIT :limit'
+            params['limit'] = limit
+        if offset is not None:
+            sql_limit += ' OFFSET :offset'
+            params['offset'] = offset
+
+        entries = [(resolved[col][0],col,resolved[col][1]) for col in [column_identity[0],*columns]]
+        select_list = ','.join([f'{expr} AS c{num}' for num,(expr,_,_) in enumerate(entries)])
+        stmt = text(f'''
+        SELECT {select_list}
+        FROM {self.schema_name}.{self.table_name} AS t0
+        {' '.join(joins)}
+        {'WHERE '+' AND '.join(conditions) if len(conditions)>0 else ''}
+        ORDER BY {','.join(orders)}
+        {sql_limit}
+        ''')
+        with self.engine.connect() as conn:
+            return self._read_selected(conn,stmt,entries,params)
+
+    def _query_selfref_chains(self,col_local_foreign:str,ids:list[int]|None=None)->pd.DataFrame:
+        '''
+        Follow a self-referencing column from every row up to its root with WITH RECURSIVE.
+
+        Returns
+        --------
+        pd.DataFrame
+            (root, node, depth, is_cycle) where node is the ancestor of root at depth.
+            A chain stops at the first node seen twice, which is marked by is_cycle.
+            Only chains from ids are followed if ids is given.
+        '''
+        column_identity = self._catalog('identity',_query_identity)
+        sql_chains = text(f'''
+        WITH RECURSIVE chain(root, node, depth, path, is_cycle) AS (
+            SELECT "{column_identity[0]}",
+                "{col_local_foreign}",
+                1,
+                ARRAY["{column_identity[0]}"],
+                "{col_local_foreign}" = "{column_identity[0]}"
+            FROM {self.schema_name}.{self.table_name}
+            WHERE "{col_local_foreign}" IS NOT NULL
+                {'' if ids is None else f'AND "{column_identity[0]}" = ANY(:ids)'}
+          UNION ALL
+            SELECT chain.root,
+                t."{col_local_foreign}",
+                chain.depth + 1,
+                chain.path || chain.node,
+                t."{col_local_foreign}" = ANY(chain.path || chain.node)
+            FROM chain
+                JOIN {self.schema_name}.{self.table_name} AS t
+                        ON t."{column_identity[0]}" = chain.node
+            WHERE t."{col_local_foreign}" IS NOT NULL
+                AND NOT chain.is_cycle
+        )
+        SELECT root, node, depth, is_cycle FROM chain;
+        ''')
+        params = None if ids is None else {'ids':[_to_db_param(id_row) for id_row in ids]}
+        with self.engine.connect() as conn:
+            return pd.read_sql_query(sql=sql_chains,con=conn,params=params)
+
+    def _expand_selfref(self,df_content:pd.DataFrame,col_local_foreign:str,
+                        selfref:Literal['wide','path']='wide',ids:list[int]|None=None,
+                        lookup:Callable[[list[int]],pd.DataFrame]|None=None)->pd.DataFrame:
+        '''
+        Expand a self-referencing column resolved by PostgreSQL.
+
+        'wide' adds columns of every ancestor level such as 'parent_id.name', 'parent_id.parent_id.name',...
+        and is skipped when the table has a cycle.
+        'path' adds one column such as 'parent_id.path' with a list of ancestor ids from the nearest.
+        If ids is given, df_content holds only those rows, only cycles reachable from them are checked,
+        and lookup reads rows of ancestors with the same columns as df_content.
+        '''
+        df_chains = self._query_selfref_chains(col_local_foreign,ids)
+        match selfref:
+            case 'path':
+                df_path = df_chains[~df_chains['is_cycle']].sort_values(['root','depth'])
+                paths = df_path.groupby('root')['node'].agg(list).to_dict()
+                df_content[f'{col_local_foreign}.path'] = [paths.get(id_row,[]) for id_row in df_content.index]
+                return df_content
+            case 'wide':
+                if len(df_chains) == 0 or df_chains['is_cycle'].any():
+                    return df_content
+
+        if lookup is None:
+            df_content_original = df_content.copy()
+        else:
+            df_content_original = lookup(sorted(set(df_chains['node'].to_list())))
+        levels = []
+        current_selfref=col_local_foreign
+        for depth in range(1,df_chains['depth'].max()+1):
+            df_depth = df_chains[df_chains['depth']==depth]
+            ser_ancestor = pd.Series(df_depth['node'].to_list(),index=df_depth['root'].to_list(),dtype='Int64')
+            df_level = pd.merge(ser_ancestor.reindex(df_content.index).to_frame('__ancestor'),df_content_original,'left',
+                                left_on='__ancestor',right_index=True)
+            df_level = df_level[df_content_original.columns]
+            levels.append(df_level.rename(columns={col:f'{current_selfref}.{col}' for col in df_level.columns}))
+            current_selfref=f'{current_selfref}.{col_local_foreign}'
+        df_content = pd.concat([df_content]+levels,axis=1)
+        del df_content[current_selfref]
+        return df_content
+
+    def _expand_selfref_pandas(self,df_content:pd.DataFrame,col_local_foreign:str)->pd.DataFrame:
+        import networkx as nx
+        if df_content[col_local_foreign].isnull().all():
+            return df_content
+        try:
+            tos=df_content.replace({np.nan: None}).index.to_list()
+            froms=df_content[col_local_foreign].replace({np.nan: None}).to_list()
+            exclude_none = [(fr,to) for fr,to in zip(froms,tos)
+                            if (fr is not None) and( to is not None)]
+
+            gr=nx.DiGraph(exclude_none)
+            nx.find_cycle(gr)
+        except nx.NetworkXNoCycle as noc:
+            df_content_original = df_content.copy()
+
+            current_selfref=col_local_foreign
+            while not df_content[current_selfref].isnull().all():
+                renamer = {f'{col}__selfpost':f'{current_selfref}.{col}' for col in df_content.columns}
+                df_content = pd.merge(df_content,df_content_original,'left',
+                                    left_on=current_selfref,right_index=True,
+                                    suffixes=('','__selfpost'))
+                df_content =df_content.rename(columns=renamer)
+
+                current_selfref=f'{current_selfref}.{col_local_foreign}'
+            else:
+                del df_content[current_selfref]
+        return df_content
+
+    def _iter_read(self,ascending=False,remove_original_id=False,expansion:Literal['join','pandas']='join',
+                   selfref:Literal['wide','path']='wide',executor:Executor|None=None):
+        column_identity = self._catalog('identity',_query_identity).copy()
+        yield column_identity, 'get_identity'
+
+        df_types = self._catalog('types',_query_types)
+        wanted = yield df_types.copy(), 'get_types' #TableSnapshot sends the stage it needs
+
+        if expansion == 'join' and wanted in ('read_with_foreign','addresses'):
+            #one query reads the local table and its joined foreign tables
+            stmt,entries,merges,order = self._compile_select(include_local=True)
+            with self.engine.connect() as conn:
+                df_content = self._read_selected(conn,text(stmt),entries)
+            columns = [col for col in df_types.index if col not in column_identity]
+            yield df_content[columns].copy(), 'read_without_foreign'
+        else:
+            sql_content = text(f'SELECT * FROM {self.schema_name}.{self.table_name}')
+            with self.engine.connect() as conn:
+                df_content = self._read_typed(conn,sql_content)
+            yield df_content.copy(), 'read_without_foreign'
+            if expansion == 'join':
+                stmt,entries,merges,order = self._compile_select()
+                if len(entries)>1:
+                    with self.engine.connect() as conn:
+                        df_content = df_content.join(self._read_selected(conn,text(stmt),entries))
+
+        yield self._get_types_with_foreign(remove_original_id), 'get_types_with_foreign'
+
+        if expansion == 'join':
+            df_merges = self._read_merges(merges,ascending,executor)
+            with _span('merge',table=f'{self.schema_name}.{self.table_name}'):
+                df_content, foreign_columns = self._merge_foreign(df_content,merges,order,df_merges)
+                df_content = self._assemble_expanded(df_content,foreign_columns,remove_original_id,selfref)
 
-                df_ftable=ts.read_expand(ascending=ascending)
+        foreign_tables_ts =self.get_foreign_tables() 
+        if expansion == 'pandas':
+            df_ftables = self._read_foreign_tables([ts for ts in foreign_tables_ts.values() if not self._is_selfref(ts)],
+                                                   ascending,expansion,executor)
+        for col_local_foreign in foreign_tables_ts:
+            if expansion == 'join':
+                break
+            if not self._is_selfref(foreign_tables_ts[col_local_foreign]):
+                ts = foreign_tables_ts[col_local_foreign]
+                df_ftable=df_ftables[(ts.schema_name,ts.table_name)]
                 column_changer={col:f'{col_local_foreign}.{col}' for col in df_ftable.columns.to_list()}
                 df_ftable=df_ftable.rename(columns=column_changer)
                 df_content = pd.merge(df_content,df_ftable,'left',left_on=col_local_foreign,right_index=True)
                 if remove_original_id:
                     del df_content[col_local_foreign]
             else:
-                if df_content[col_local_foreign].isnull().all():
-                    continue
-                else:
-                    try:
-                        tos=df_content.replace({np.nan: None}).index.to_list()
-                        froms=df_content[col_local_foreign].replace({np.nan: None}).to_list()
-                        exclude_none = [(fr,to) for fr,to in zip(froms,tos)
-                                        if (fr is not None) and( to is not None)]
-
-                        gr=nx.DiGraph(exclude_none)
-                        nx.find_cycle(gr)
-                    except nx.NetworkXNoCycle as noc:
-                        df_content_original = df_content.copy()
-
-                        current_selfref=col_local_foreign
-                        while not df_content[current_selfref].isnull().all():
-                            renamer = {f'{col}__selfpost':f'{current_selfref}.{col}' for col in df_content.columns}
-                            df_content = pd.merge(df_content,df_content_original,'left',
-                                                left_on=current_selfref,right_index=True,
-                                                suffixes=('','__selfpost'))
-                            df_content =df_content.rename(columns=renamer)
-
-                            current_selfref=f'{current_selfref}.{col_local_foreign}'
-                        else:
-                            del df_content[current_selfref]
-        yield df_types.copy(), 'get_types_with_foreign'
+                df_content = self._expand_selfref_pandas(df_content,col_local_foreign)
 
         df_rwf = df_content.sort_index(ascending=ascending)
         yield df_rwf.copy(), 'read_with_foreign'
@@ -273,7 +1563,7 @@ class TableStructure:
             df_address[col] = df_address[col_sub[col]]
         yield df_address.copy(), 'addresses'
     def get_identity(self):
-        return chpo.CheckPointFunction(self._iter_read).get_identity() 
+        return self._current_snapshot().get_identity()
         
     def get_default_value(self):
         ser_ret_new = self.get_types()['column_default']
@@ -281,33 +1571,324 @@ class TableStructure:
     
     
     def get_types(self)->pd.DataFrame:
-        return chpo.CheckPointFunction(self._iter_read).get_types()
+        return self._current_snapshot().get_types()
     def get_types_expanded(self)->pd.DataFrame:
-        return chpo.CheckPointFunction(self._iter_read).get_types_with_foreign()
+        return self._current_snapshot().get_types_with_foreign()
+
+    @_traced
+    def read(self,ascending=False,columns:list[str]|None=None,filters:dict[str,Any]|None=None,
+             order_by:str|list[str]|None=None,limit:int|None=None,offset:int|None=None)->pd.DataFrame:
+        '''
+        Read a table without expanding foreign ids.
+
+        Columns, filters, order and limit are compiled into SQL with bound parameters.
+
+        Parameters
+        ----------
+        ascending : bool
+            Sort by order_by and id.
+        columns : list[str] | None
+            Columns to read.
+        filters : dict[str,Any] | None
+            Conditions by column such as
+            {'color':'red'} (equality), {'color':None} (IS NULL), {'color':['red','green']} (IN),
+            {'weight':slice(3,None)} (3 <= weight), {'date':slice(start,end)} (start <= date < end).
+        order_by : str | list[str] | None
+            Columns to sort by before id.
+        limit : int | None
+            The maximum number of rows.
+        offset : int | None
+            The number of rows to skip.
+
+        Examples
+        --------
+        >>> ts.read(columns=['color'],filters={'weight':slice(3,None)},order_by='weight',limit=10)
+        '''
+        if columns is None and filters is None and order_by is None and limit is None and offset is None:
+            disk_cache = _disk_caches.get(self.engine)
+            if disk_cache is not None and self._snapshot is None:
+                df_content = disk_cache.fetch(self,'read',{},lambda: self._current_snapshot().read_without_foreign())
+            else:
+                df_content = self._current_snapshot().read_without_foreign()
+            return df_content.sort_index(ascending=ascending)
+        if columns is None:
+            column_identity = self._catalog('identity',_query_identity)
+            columns = [col for col in self._catalog('types',_query_types).index if col not in column_identity]
+        return self._read_pushdown(columns,filters,order_by,ascending,limit,offset)
+
+    @_traced
+    def read_incremental(self,by:str='xmin',ascending=False,reconcile_deletes=True)->pd.DataFrame:
+        '''
+        Read a table like read() but fetch only rows changed since the previous call and merge them into the last result.
+
+        Parameters
+        ----------
+        by : str
+            'xmin' fetches rows inserted or updated by transactions not yet visible at the previous call.
+            The identity column fetches only inserted rows.
+            Any other column such as 'updated_at' fetches rows whose value is not less than the previous maximum.
+        ascending : bool
+            Sort by id.
+        reconcile_deletes : bool
+            Drop rows whose ids are not in the table anymore, by reading ids only.
+
+        Examples
+        --------
+        >>> ts.read_incremental()
+        >>> ts.read_incremental(by='updated_at')
+        '''
+        column_identity = self._catalog('identity',_query_identity)
+        table = f'{self.schema_name}.{self.table_name}'
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='REPEATABLE READ')
+            if by == 'xmin':
+                mark = conn.execute(text('SELECT txid_snapshot_xmin(txid_current_snapshot()) % 4294967296')).scalar()
+            if by not in self._incremental:
+                df_content = self._read_typed(conn,text(f'SELECT * FROM {table}'))
+            else:
+                mark_previous, df_content = self._incremental[by]
+                match by:
+                    case 'xmin':
+                        #ages compare xids in the order of transactions even after the 32-bit counter wraps around
+                        condition = 'age(xmin) <= age(CAST(CAST(:mark AS text) AS xid))'
+                    case column if column == column_identity[0]:
+                        condition = f'"{column}" > :mark'
+                    case column:
+                        condition = f'"{column}" >= :mark'
+                stmt = text(f'SELECT * FROM {table} WHERE {condition}')
+                df_delta = self._read_typed(conn,stmt,{'mark':_to_db_param(mark_previous)})
+                if reconcile_deletes:
+                    ids = conn.execute(text(f'SELECT "{column_identity[0]}" FROM {table}')).scalars().all()
+                    df_content = df_content[df_content.index.isin(ids)]
+                df_content = pd.concat([df_content.drop(index=df_delta.index,errors='ignore'),df_delta])
+            if by != 'xmin':
+                values = df_content.index if by == column_identity[0] else df_content[by]
+                mark = values.max() if len(df_content) > 0 else None
+                if _is_missing(mark):
+                    mark = self._incremental.get(by,(None,))[0]
+        if mark is None and by != 'xmin':
+            self._incremental.pop(by,None)
+        else:
+            self._incremental[by] = (mark,df_content)
+        return df_content.sort_index(ascending=ascending)
+
+    @_traced
+    def read_expand(self,ascending=False,remove_original_id=False,
+                    expansion:Literal['join','pandas']='join',
+                    selfref:Literal['wide','path']='wide',
+                    columns:list[str]|None=None,filters:dict[str,Any]|None=None,
+                    order_by:str|list[str]|None=None,limit:int|None=None,offset:int|None=None,
+                    max_workers:int|None=None,executor:Executor|None=None)->pd.DataFrame:
+        '''
+        Read a table with columns of foreign tables such as 'fruit_id.color'.
+
+        Parameters
+        ----------
+        ascending : bool
+            Sort by id.
+        remove_original_id : bool
+            Remove local columns of foreign ids.
+        expansion : {'join','pandas'}
+            'join' lets PostgreSQL join foreign tables in a single query.
+            'pandas' reads every foreign table and merges them in pandas.
+        selfref : {'wide','path'}
+            How 'join' expands a self-referencing column such as 'parent_id'.
+            'wide' adds columns of every ancestor level such as 'parent_id.name', 'parent_id.parent_id.name',...
+            'path' adds a list of ancestor ids such as 'parent_id.path'.
+        columns, filters, order_by, limit, offset
+            Same as read, and columns of foreign tables such as 'fruit_id.color' are possible.
+            Only foreign tables on the way to the given columns are joined.
+            Without columns, every column of the selected rows is expanded.
+            Then cycles of a self-referencing column are checked only from the selected rows.
+        max_workers : int | None
+            Read foreign tables that are not joined in the main query in parallel on this many threads.
+            Each distinct foreign table is read once however many columns refer to it.
+        executor : Executor | None
+            An executor to read foreign tables on instead of a new one of max_workers.
 
-    def read(self,ascending=False,columns:list[str]|None=None)->pd.DataFrame:
-        df_content:pd.DataFrame = chpo.CheckPointFunction(self._iter_read).read_without_foreign()
-        df_res= df_content.sort_index(ascending=ascending)
+        Examples
+        --------
+        >>> ts.read_expand(columns=['fruit_id.color'],filters={'fruit_id.name':'apple'})
+        '''
+        if columns is None and filters is None and order_by is None and limit is None and offset is None:
+            if executor is None and max_workers is not None:
+                with ThreadPoolExecutor(max_workers) as executor:
+                    return self.read_expand(ascending,remove_original_id,expansion,selfref,executor=executor)
+            def read():
+                return self._current_snapshot().read_with_foreign(ascending,remove_original_id=remove_original_id,
+                                                                  expansion=expansion,selfref=selfref,executor=executor)
+            disk_cache = _disk_caches.get(self.engine)
+            if disk_cache is not None and self._snapshot is None:
+                args = {'remove_original_id':remove_original_id,'expansion':expansion,'selfref':selfref}
+                return disk_cache.fetch(self,'read_expand',args,read).sort_index(ascending=ascending)
+            return read()
         if columns is not None:
-            df_res = df_res[columns]
-        return df_res.copy()
+            return self._read_pushdown(columns,filters,order_by,ascending,limit,offset)
+        df_ids = self._read_pushdown([],filters,order_by,ascending,limit,offset)
+        df_content = self._read_rows_expanded(df_ids.index.to_list(),remove_original_id,selfref)
+        return df_content.loc[df_ids.index]
+
+    def iter_read(self,chunksize:int=10000,expand=False,ascending=True,remove_original_id=False,
+                  selfref:Literal['wide','path']='wide')->Iterator[pd.DataFrame]:
+        '''
+        Read a table chunk by chunk through a server-side cursor.
+
+        Parameters
+        ----------
+        chunksize : int
+            The number of rows of each chunk.
+        expand : bool
+            Read columns of foreign tables like read_expand.
+        ascending : bool
+            Order of ids.
+        remove_original_id : bool
+            Remove local columns of foreign ids when expand.
+        selfref : {'wide','path'}
+            How to expand a self-referencing column when expand.
+            Only 'path' is possible because ancestors can be in other chunks.
+        
+        See Also
+        --------
+        read
+        read_expand
+
+        Examples
+        --------
+        >>> for df in ts.iter_read(chunksize=50000,expand=True):
+        ...     df.to_csv('export.csv',mode='a')
+        '''
+        if expand and selfref == 'wide' and self._has_selfref():
+            raise NotImplementedError("Expanding a self-referencing column by chunks needs selfref='path'.")
+        column_identity = self._catalog('identity',_query_identity)
+        order_by = f'ORDER BY "{column_identity[0]}" {"ASC" if ascending else "DESC"}'
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(stream_results=True,max_row_buffer=chunksize)
+            if not expand:
+                stmt = text(f'SELECT * FROM {self.schema_name}.{self.table_name} {order_by}')
+                yield from self._read_typed(conn,stmt,chunksize=chunksize)
+                return
+
+            stmt,entries,merges,order = self._compile_select(include_local=True)
+            df_merges = self._read_merges(merges)
+            stmt = text(f'{stmt} {order_by.replace("ORDER BY ","ORDER BY t0.")}')
+            for df_chunk in self._read_selected(conn,stmt,entries,chunksize=chunksize):
+                df_chunk, foreign_columns = self._merge_foreign(df_chunk,merges,order,df_merges)
+                yield self._assemble_expanded(df_chunk,foreign_columns,remove_original_id,selfref,
+                                              ids=df_chunk.index.to_list())
+
+    def export(self,partitions:int|None=None,processes:int|None=None,by:Literal['id','ctid']='id',
+               expand=False,remove_original_id=False,selfref:Literal['wide','path']='wide',ascending=True,
+               output:str|None=None,url:str|None=None,executor:Executor|None=None)->pd.DataFrame|list[str]:
+        '''
+        Read a whole table in partitions on a process pool, each on its own connection.
+
+        Every partition reads a snapshot exported by pg_export_snapshot, so the result is consistent
+        like a single read while the transaction of this process stays open.
+
+        Parameters
+        ----------
+        partitions : int | None
+            The number of partitions. processes by default.
+        processes : int | None
+            The number of processes. os.cpu_count() by default.
+        by : {'id','ctid'}
+            'id' splits the range of ids evenly and suits dense ids.
+            'ctid' splits pages of the table evenly, which PostgreSQL 14 or later reads by TID range scans.
+        expand, remove_original_id, selfref
+            Same as read_expand. Ancestors of a self-referencing column in other partitions are read too.
+        ascending : bool
+            Sort by id when partitions are concatenated.
+        output : str | None
+            A directory to write partitions as part-00000.parquet, part-00001.parquet,... with pyarrow
+            instead of sending them back to this process.
+        url : str | None
+            A URL of the database for workers. The URL of the engine with its password by default.
+            Options of the engine other than the URL are not passed.
+        executor : Executor | None
+            An executor to run partitions on instead of a new process pool.
+            The new pool spawns its workers instead of forking this process, whose other threads may hold locks,
+            so a script calling export needs if __name__ == '__main__':.
+
+        Returns
+        --------
+        pd.DataFrame | list[str]
+            The table, or paths of written files if output is given.
+
+        Examples
+        --------
+        >>> df = ts.export(processes=8)
+        >>> paths = ts.export(partitions=64,processes=8,expand=True,output='export/basket')
+        '''
+        processes = (os.cpu_count() or 1) if processes is None else processes
+        partitions = processes if partitions is None else partitions
+        url = self.engine.url.render_as_string(hide_password=False) if url is None else url
+        column_identity = self._catalog('identity',_query_identity)[0]
+        table = f'{self.schema_name}.{self.table_name}'
+        if output is not None:
+            os.makedirs(output,exist_ok=True)
+        with self.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='REPEATABLE READ')
+            snapshot_id = conn.execute(text('SELECT pg_export_snapshot()')).scalar()
+            match by:
+                case 'id':
+                    low, high = conn.execute(text(f'SELECT min("{column_identity}"),max("{column_identity}") FROM {table}')).one()
+                    low, high = (0,-1) if low is None else (low,high)
+                    step = max(1,-(-(high-low+1)//partitions))
+                    bounds = [(low+num*step,low+(num+1)*step) for num in range(partitions) if low+num*step <= high]
+                    condition = f't0."{column_identity}" >= :low AND t0."{column_identity}" < :high'
+                case 'ctid':
+                    pages = conn.execute(text("SELECT pg_relation_size(CAST(:table AS regclass)) / current_setting('block_size')::bigint"),
+                                         {'table':table}).scalar()
+                    step = max(1,-(-pages//partitions))
+                    bounds = [(f'({num*step},0)',f'({(num+1)*step},0)') for num in range(partitions) if num*step < max(pages,1)]
+                    #rows on pages added after the snapshot are not visible, so the last partition is open-ended
+                    bounds[-1] = (bounds[-1][0],None)
+                    condition = 't0.ctid >= CAST(:low AS tid) AND (CAST(:high AS tid) IS NULL OR t0.ctid < CAST(:high AS tid))'
+                case _:
+                    raise NotImplementedError(f'{by} is not supported.')
+            args = [(url,self.schema_name,self.table_name,self.dtype_backend,snapshot_id,condition,{'low':low,'high':high},
+                     expand,remove_original_id,selfref,None if output is None else os.path.join(output,f'part-{num:05d}.parquet'))
+                    for num,(low,high) in enumerate(bounds)]
+            with _span('export',table=table,partitions=len(args)):
+                if executor is None:
+                    with ProcessPoolExecutor(processes,mp_context=multiprocessing.get_context('spawn')) as executor:
+                        results = list(executor.map(_export_partition,*zip(*args)))
+                else:
+                    results = list(executor.map(_export_partition,*zip(*args)))
+        if output is not None:
+            return results
+        if len(results) == 0:
+            return self.read().iloc[:0]
+        return pd.concat(results).sort_index(ascending=ascending)
 
-    def read_expand(self,ascending=False,remove_original_id=False)->pd.DataFrame:
-        df_res = chpo.CheckPointFunction(self._iter_read)(ascending,remove_original_id=remove_original_id).read_with_foreign()
-        return df_res.copy()
     def __getitem__(self, item)->pd.DataFrame:
-        return self.read_expand()[item]
+        if isinstance(item,str):
+            return self.read_expand(columns=[item])[item]
+        return self.read_expand(columns=list(item))
     
     def pipe[T](self,func:Callable[...,T],*args,**kwargs)->T:
         return func(self,*args,**kwargs)
 
+    def get_lookup(self,column:str,max_rows:int|None=None)->'LookupIndex':
+        '''
+        A lookup index of value <-> id of a local column, shared by every TableStructure of the table on the engine.
+
+        Parameters
+        ----------
+        column : str
+            A local column.
+        max_rows : int | None
+            Do not cache a table estimated larger than this and query by an index of the column instead.
+            None keeps the limit of the existing index, which has none at first.
+
+        Returns
+        --------
+        LookupIndex
+        '''
+        return _get_lookup(self,column,max_rows)
+
     def get_local_val_to_id(self,column:str):
-        convert_table:pd.DataFrame = chpo.CheckPointFunction(self._iter_read).read_without_foreign()
-        ser_filtered = convert_table[column].dropna()
-        ser_filtered.index = ser_filtered.index.astype('Int64')
-        ret = ser_filtered.to_dict()
-        ret = {ret[key]:key for key in ret}
-        return ret
+        return self.get_lookup(column).to_dict()
         
     def _get_local_foreign_id(self,row,column)->int:
         '''
@@ -326,9 +1907,8 @@ class TableStructure:
             foreign id.
         
         '''
-        df = chpo.CheckPointFunction(self._iter_read).addresses()
-
-        return df.loc[row,column]
+        id_foreign = self.get_lookup(column.split('.')[0]).get_value(row)
+        return pd.NA if id_foreign is None else id_foreign
     
     #upload
     def set_default_value(self,col:str,val:str):
@@ -338,74 +1918,256 @@ class TableStructure:
         with self.engine.connect() as conn:
             conn.execute(stmt_set_default)
             conn.commit()
+        self.refresh()
 
     def change_column_name(self,col:str,val:str):
         sql =text(f'ALTER TABLE IF EXISTS {self.schema_name}.{self.table_name} RENAME {col} TO {val};')
         with self.engine.connect() as conn:
             conn.execute(sql)
             conn.commit()
+        self.refresh()
 
-    def upload(self,id_row:int,**kwarg):
-        column_identity = chpo.CheckPointFunction(self._iter_read).get_identity()
-        cp = kwarg.copy()
-        for column in kwarg:
-            if self.check_if_not_local_column(column):
-                local_column=column.split(".")[0]
-                foreign_column=".".join(column.split(".")[1:])
-                foreign_val = kwarg[column]
-                foreign_upload_dict = {foreign_column:foreign_val}
-
-                local_foreign_id = self._get_local_foreign_id(id_row,column)
-                foreign_ts=self.get_foreign_tables()[local_column]
-
-                if local_foreign_id is pd.NA:
-                    #Add when local column of the row has no foreign columns.
-                    foreign_index = set(foreign_ts.read().index.to_list())
-                    df_foreign_after =foreign_ts.append(**foreign_upload_dict)
-                    def get_foreign_returned():
-                        foreign_index_after = set(df_foreign_after.index.to_list())
-                        foreign_index_diff = foreign_index_after - foreign_index
-                        foreign_index_list_diff = [v for v in foreign_index_diff]
-                        if len(foreign_index_list_diff)!=1:
-                            raise NotImplementedError("The amount of changed index in foreign is not one.")
-                        return foreign_index_list_diff[0]
-                    
-                    foreign_id = get_foreign_returned()
-                    upload_local = {local_column:foreign_id}
-                    self.upload(id_row,**upload_local)
-                else:
-                    foreign_upload_dict = {foreign_column:foreign_val}
-                    foreign_ts.upload(local_foreign_id,**foreign_upload_dict)
+    @_traced
+    def upload(self,id_row:int,return_mode:Literal['none','returning','full']='full',**kwarg):
+        '''
+        Update a row.
 
-                del cp[column]
-        
-        if len(cp)<1:
-            return self.read()
+        Parameters
+        ----------
+        id_row : int
+            An id of the row.
+        return_mode : {'none','returning','full'}
+            'none' returns nothing, 'returning' returns the updated row only,
+            'full' reads the whole table again.
+        kwarg
+            Values by column such as color='red' or a foreign column such as **{'fruit_id.color':'red'}.
 
-        original=",".join([f'"{key}" = {_convert_into_sql_string(cp[key])}' for key in cp])
+        Returns
+        --------
+        pd.DataFrame | None
+            A dataframe without expanding foreign ids.
+        '''
+        column_identity = self.get_identity()
+        cp, cells = _split_foreign_columns(kwarg,self.get_foreign_tables())
+        with self.engine.begin() as conn:
+            if len(cells)>0:
+                self._update_foreign(conn,{id_row:cells})
         
-        sql = text(f'''
-        UPDATE {self.schema_name}.{self.table_name}
-        SET {original}
-        WHERE {column_identity[0]} = {id_row};
-        ''')
+            if len(cp)<1:
+                if return_mode == 'returning':
+                    sql = text(f'''
+                    SELECT * FROM {self.schema_name}.{self.table_name}
+                    WHERE "{column_identity[0]}" = :id_row;
+                    ''')
+                    df_returned = self._read_typed(conn,sql,{'id_row':_to_db_param(id_row)})
+            else:
+                original=",".join([f'"{key}" = :s{num}' for num,key in enumerate(cp)])
+                params = {f's{num}':_to_db_param(cp[key]) for num,key in enumerate(cp)}
+                params['id_row'] = _to_db_param(id_row)
         
-        with self.engine.connect() as conn:
-            conn.execute(sql)
-            conn.commit()
-            
+                sql = text(f'''
+                UPDATE {self.schema_name}.{self.table_name}
+                SET {original}
+                WHERE "{column_identity[0]}" = :id_row
+                {'RETURNING *' if return_mode == 'returning' else ''};
+                ''')
+                if return_mode == 'returning':
+                    df_returned = self._read_typed(conn,sql,params)
+                else:
+                    conn.execute(sql,params)
+                _lookup_changed(conn,self,{id_row:cp})
+        self._invalidate_snapshot()
         
-        return self.read()
+        match return_mode:
+            case 'returning':
+                return df_returned
+            case 'full':
+                return self.read()
+        return None
 
-    def upload_dataframe(self,df:pd.DataFrame):
+    def _update_rows(self,conn:sqlalchemy.Connection,rows:dict[Any,dict[str,Any]],batch_size:int=1000):
+        '''
+        Update rows by id on conn. Local columns are grouped by column set into UPDATE ... FROM (VALUES ...)
+        and foreign columns are written by _update_foreign.
+        '''
+        column_identity = self.get_identity()[0]
+        foreign_tables_ts = self.get_foreign_tables()
+        groups : dict[tuple[str,...],dict[Any,dict[str,Any]]] = {}
+        cells : dict[Any,dict[str,dict[str,Any]]] = {}
+        for id_row,row in rows.items():
+            local, foreign = _split_foreign_columns(row,foreign_tables_ts)
+            if len(local)>0:
+                groups.setdefault(tuple(local),{})[id_row] = local
+            if len(foreign)>0:
+                cells[id_row] = foreign
+        for columns,group in groups.items():
+            self._update_values(conn,list(columns),group,column_identity,batch_size)
+        if len(cells)>0:
+            self._update_foreign(conn,cells,batch_size)
+
+    def _update_foreign(self,conn:sqlalchemy.Connection,cells:dict[Any,dict[str,dict[str,Any]]],batch_size:int=1000):
+        '''
+        Write foreign columns of rows such as {id_row:{'fruit_id':{'color':'red'}}} on conn, batched per foreign table.
+
+        Foreign rows which rows refer to are updated.
+        Rows without a foreign id get new foreign rows by INSERT ... RETURNING and are linked back by one batched UPDATE.
+        '''
+        column_identity = self.get_identity()[0]
+        foreign_tables_ts = self.get_foreign_tables()
+        local_columns = list(dict.fromkeys([col for foreign in cells.values() for col in foreign]))
+        col_list = ','.join([f'"{col}"' for col in local_columns])
+        result = conn.execute(text(f'''
+        SELECT "{column_identity}",{col_list} FROM {self.schema_name}.{self.table_name}
+        WHERE "{column_identity}" = ANY(:ids);
+        '''),{'ids':[_to_db_param(id_row) for id_row in cells]})
+        current = {row[0]:dict(zip(local_columns,row[1:])) for row in result}
+        for id_row in cells:
+            if _to_db_param(id_row) not in current:
+                raise KeyError(f'{id_row} is not an id of {self.schema_name}.{self.table_name}.')
+
+        for col in local_columns:
+            updates : dict[Any,dict[str,Any]] = {}
+            inserts : list[tuple[Any,dict[str,Any]]] = []
+            for id_row,foreign in cells.items():
+                if col not in foreign:
+                    continue
+                id_foreign = current[_to_db_param(id_row)][col]
+                if id_foreign is not None:
+                    updates.setdefault(id_foreign,{}).update(foreign[col])
+                elif not all([_is_missing(val) for val in foreign[col].values()]):
+                    inserts.append((id_row,foreign[col]))
+            if len(updates)>0:
+                foreign_tables_ts[col]._update_rows(conn,updates,batch_size)
+            if len(inserts)>0:
+                ids_new = foreign_tables_ts[col]._insert_rows(conn,[vals for _,vals in inserts],batch_size)
+                links = {id_row:{col:id_new} for (id_row,_),id_new in zip(inserts,ids_new)}
+                self._update_values(conn,[col],links,column_identity,batch_size)
+
+    def _insert_rows(self,conn:sqlalchemy.Connection,rows:list[dict[str,Any]],batch_size:int=1000)->list[int]:
+        '''
+        Insert rows on conn by INSERT ... RETURNING and return their ids.
+        Missing values are left to defaults and foreign columns are written by _update_foreign.
+        '''
+        column_identity = self.get_identity()[0]
+        foreign_tables_ts = self.get_foreign_tables()
+        ids : list[int] = [0]*len(rows)
+        groups : dict[tuple[str,...],list[tuple[int,dict[str,Any]]]] = {}
+        cells : dict[int,dict[str,dict[str,Any]]] = {}
+        for pos,row in enumerate(rows):
+            local, foreign = _split_foreign_columns({col:row[col] for col in row if not _is_missing(row[col])},
+                                                    foreign_tables_ts)
+            groups.setdefault(tuple(local),[]).append((pos,local))
+            if len(foreign)>0:
+                cells[pos] = foreign
+        for columns,group in groups.items():
+            if len(columns)>0:
+                ids_new = self._insert_values(conn,columns,[local for _,local in group],column_identity,batch_size)
+            else:
+                stmt = text(f'INSERT INTO {self.schema_name}.{self.table_name} DEFAULT VALUES RETURNING "{column_identity}";')
+                ids_new = [conn.execute(stmt).scalar() for _ in group]
+            for (pos,_),id_new in zip(group,ids_new):
+                ids[pos] = id_new
+        if len(cells)>0:
+            self._update_foreign(conn,{ids[pos]:foreign for pos,foreign in cells.items()},batch_size)
+        return ids
+
+    def _update_values(self,conn:sqlalchemy.Connection,columns:list[str],rows:dict[Any,dict[str,Any]],
+                       column_identity:str,batch_size:int):
+        sql_types = self._catalog('sql_types',_query_sql_types)
+        all_columns = [column_identity]+columns
+        col_list = ','.join([f'"{col}"' for col in all_columns])
+        set_list = ','.join([f'"{col}" = v."{col}"' for col in columns])
+        batch_size = max(1,min(batch_size,65535//len(all_columns))) #limit of bound parameters in a statement
+        ids = list(rows)
+        for start in range(0,len(ids),batch_size):
+            batch = ids[start:start+batch_size]
+            values = ','.join(['('+','.join([f'CAST(:v{r}_{c} AS {sql_types[col]})' for c,col in enumerate(all_columns)])+')' 
+                               for r in range(len(batch))])
+            params = {f'v{r}_{c}':_to_db_param(id_row if col == column_identity else rows[id_row][col]) 
+                      for r,id_row in enumerate(batch) for c,col in enumerate(all_columns)}
+            conn.execute(text(f'''
+            UPDATE {self.schema_name}.{self.table_name} AS target
+            SET {set_list}
+            FROM (VALUES {values}) AS v({col_list})
+            WHERE target."{column_identity}" = v."{column_identity}";
+            '''),params)
+        _lookup_changed(conn,self,rows)
+
+    def _update_copy(self,conn:sqlalchemy.Connection,columns:list[str],rows:dict[Any,dict[str,Any]],
+                     column_identity:str,batch_size:int)->bool:
+        copy = _get_copy_from(conn)
+        if copy is None:
+            return False
+        sql_types = self._catalog('sql_types',_query_sql_types)
+        all_columns = [column_identity]+columns
+        col_list = ','.join([f'"{col}"' for col in all_columns])
+        set_list = ','.join([f'"{col}" = '+_cast_staged(f'v."{col}"',sql_types[col]) for col in columns])
+        #staged as text and cast like _update_values, so that both accept the same values
+        conn.execute(text(f'''
+        CREATE TEMP TABLE pyplus_update ({','.join([f'"{col}" text' for col in all_columns])}) ON COMMIT DROP;
+        '''))
+        ids = list(rows)
+        for start in range(0,len(ids),batch_size):
+            records = [[id_row]+[rows[id_row][col] for col in columns] for id_row in ids[start:start+batch_size]]
+            copy(f'COPY pyplus_update ({col_list}) FROM STDIN WITH (FORMAT csv)',records)
+        conn.execute(text(f'''
+        UPDATE {self.schema_name}.{self.table_name} AS target
+        SET {set_list}
+        FROM pyplus_update AS v
+        WHERE target."{column_identity}" = {_cast_staged(f'v."{column_identity}"',sql_types[column_identity])};
+        '''))
+        conn.execute(text('DROP TABLE pyplus_update;'))
+        _lookup_changed(conn,self,rows)
+        return True
+
+    @_traced
+    def upload_dataframe(self,df:pd.DataFrame,batch_size:int=1000,staging_threshold:int=10000):
         '''
         dataframe(argument)'s index as database's row id.
+
+        Local columns of every row are updated in one transaction by UPDATE ... FROM (VALUES ...),
+        or through a temporary table filled by COPY when there are more rows than staging_threshold.
+        Missing values are written as NULL.
+        Foreign columns such as 'fruit_id.color' are written in the same transaction, batched per foreign table.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Rows to update indexed by id.
+        batch_size : int
+            The number of rows sent at once.
+        staging_threshold : int
+            The number of rows from which rows are staged through a temporary table.
+
+        See Also
+        --------
+        upload
         '''
-        dict_df = df.to_dict('index')
-        for row in dict_df:
-            self.upload(row,**dict_df[row])
+        foreign_tables = self.get_foreign_tables()
+        local_columns = [col for col in df.columns 
+                         if '.' not in col or col.split('.')[0] not in foreign_tables]
+        foreign_columns = [col for col in df.columns if col not in local_columns]
 
-    def upload_appends(self,*row:dict[str,Any]):
+        if len(df)==0:
+            return
+        with self.engine.begin() as conn:
+            if len(local_columns)>0:
+                dict_df = df[local_columns].to_dict('index')
+                column_identity = self.get_identity()[0]
+                staged = False
+                if len(dict_df)>staging_threshold:
+                    staged = self._update_copy(conn,local_columns,dict_df,column_identity,batch_size)
+                if not staged:
+                    self._update_values(conn,local_columns,dict_df,column_identity,batch_size)
+
+            if len(foreign_columns)>0:
+                dict_df = df[foreign_columns].to_dict('index')
+                cells = {id_row:_split_foreign_columns(dict_df[id_row],foreign_tables)[1] for id_row in dict_df}
+                self._update_foreign(conn,cells,batch_size)
+        self._invalidate_snapshot()
+
+    @_traced
+    def upload_appends(self,*row:dict[str,Any],return_mode:Literal['none','returning','full']='full'):
         '''
         Append rows
         
@@ -413,14 +2175,18 @@ class TableStructure:
         ----------
         row : dict[str,Any]
             A row such as {'column1':'value1','column2':'value2',...}.
+        return_mode : {'none','returning','full'}
+            'none' returns nothing, 'returning' returns the appended rows only,
+            'full' reads the whole table again.
         
         See Also
         --------
         upload
+        upload_appends_bulk
         
         Returns
         --------
-        pd.DataFrame
+        pd.DataFrame | None
             A dataframe without expanding foreign ids.
         '''
         def process_each_row(**kwarg):
@@ -441,6 +2207,7 @@ class TableStructure:
         
         processed_rows = [process_each_row(**row) for row in row]
         
+        dfs_returned = []
         with self.engine.connect() as conn:
             for row in processed_rows:   
                 if len(row) == 0:
@@ -448,19 +2215,171 @@ class TableStructure:
                     continue
 
                 columns = ','.join([f'"{col}"' for col in row])
-                values = ','.join([_convert_into_sql_string(row[col]) for col in row])
+                values = ','.join([f':v{num}' for num in range(len(row))])
+                params = {f'v{num}':_to_db_param(row[col]) for num,col in enumerate(row)}
                 stmt = text(f'''
                 INSERT INTO {self.schema_name}.{self.table_name} ({columns})
                 VALUES ({values})
+                RETURNING {'*' if return_mode == 'returning' else f'"{self.get_identity()[0]}"'}
                 ''')
-                conn.execute(stmt)
+                if return_mode == 'returning':
+                    dfs_returned.append(self._read_typed(conn,stmt,params))
+                    id_new = dfs_returned[-1].index[0]
+                else:
+                    id_new = conn.execute(stmt,params).scalar()
+                _lookup_changed(conn,self,{id_new:row})
+            if return_mode == 'returning' and len(dfs_returned) == 0:
+                stmt = text(f'SELECT * FROM {self.schema_name}.{self.table_name} LIMIT 0')
+                dfs_returned.append(self._read_typed(conn,stmt))
             conn.commit()
+        self._invalidate_snapshot()
+
+        match return_mode:
+            case 'returning':
+                return pd.concat(dfs_returned).sort_index(ascending=False)
+            case 'full':
+                return self.read()
+        return None
+
+    def _insert_copy(self,conn:sqlalchemy.Connection,columns:tuple[str,...],rows:list[dict[str,Any]],
+                     column_identity:str,batch_size:int)->list[int]|None:
+        copy = _get_copy_from(conn)
+        if copy is None:
+            return None
+
+        sql_types = self._catalog('sql_types',_query_sql_types)
+        col_list = ','.join([f'"{col}"' for col in columns])
+        #staged as text and cast by INSERT, so that 'copy' accepts the same values as bound parameters of 'values'
+        conn.execute(text(f'''
+        CREATE TEMP TABLE pyplus_bulk ({','.join([f'"{col}" text' for col in columns])}, pyplus_ord bigint) ON COMMIT DROP;
+        '''))
+        for start in range(0,len(rows),batch_size):
+            records = [[row[col] for col in columns]+[ord] 
+                       for ord,row in enumerate(rows[start:start+batch_size],start)]
+            copy(f'COPY pyplus_bulk ({col_list},pyplus_ord) FROM STDIN WITH (FORMAT csv)',records)
+        result = conn.execute(text(f'''
+        INSERT INTO {self.schema_name}.{self.table_name} ({col_list})
+        SELECT {','.join([_cast_staged(f'"{col}"',sql_types[col]) for col in columns])} FROM pyplus_bulk ORDER BY pyplus_ord
+        RETURNING "{column_identity}";
+        '''))
+        ids = [row[0] for row in result]
+        conn.execute(text('DROP TABLE pyplus_bulk;'))
+        _lookup_changed(conn,self,dict(zip(ids,rows)))
+        return ids
+
+    def _insert_values(self,conn:sqlalchemy.Connection,columns:tuple[str,...],rows:list[dict[str,Any]],
+                       column_identity:str,batch_size:int)->list[int]:
+        col_list = ','.join([f'"{col}"' for col in columns])
+        batch_size = max(1,min(batch_size,65535//len(columns))) #limit of bound parameters in a statement
+        ids = []
+        for start in range(0,len(rows),batch_size):
+            batch = rows[start:start+batch_size]
+            values = ','.join(['('+','.join([f':v{r}_{c}' for c in range(len(columns))])+')' for r in range(len(batch))])
+            params = {f'v{r}_{c}':_to_db_param(row[col]) for r,row in enumerate(batch) for c,col in enumerate(columns)}
+            result = conn.execute(text(f'''
+            INSERT INTO {self.schema_name}.{self.table_name} ({col_list})
+            VALUES {values}
+            RETURNING "{column_identity}";
+            '''),params)
+            ids += [row[0] for row in result]
+        _lookup_changed(conn,self,dict(zip(ids,rows)))
+        return ids
+
+    @_traced
+    def upload_appends_bulk(self,rows:pd.DataFrame|Iterable[dict[str,Any]],batch_size:int=1000,
+                            method:Literal['copy','values']='copy')->list[int|None]:
+        '''
+        Append many rows in one transaction.
+
+        Like upload_appends, foreign columns and missing values are skipped so that column defaults apply.
+        
+        Parameters
+        ----------
+        rows : pd.DataFrame | Iterable[dict[str,Any]]
+            Rows to append. An index of a dataframe is ignored.
+        batch_size : int
+            The number of rows sent at once.
+        method : {'copy','values'}
+            'copy' streams rows by COPY FROM STDIN into a temporary table, and falls back to 'values' if the driver cannot copy.
+            'values' sends multi-row INSERT with bound parameters.
+        
+        See Also
+        --------
+        upload_appends
+        
+        Returns
+        --------
+        list[int|None]
+            Generated ids in the order of rows. None for a row without any value.
+
+        Examples
+        --------
+        >>> ts.upload_appends_bulk(pd.DataFrame({'color':['red','green'],'weight':[3,5]}))
+        [7, 8]
+        '''
+        if isinstance(rows,pd.DataFrame):
+            rows = rows.to_dict('records')
+        foreign_tables = self.get_foreign_tables()
+        def is_local(column:str):
+            return '.' not in column or column.split('.')[0] not in foreign_tables
+
+        ret : list[int|None] = []
+        groups : dict[tuple[str,...],list[tuple[int,dict[str,Any]]]] = {}
+        for pos,row in enumerate(rows):
+            ret.append(None)
+            cp = {col:row[col] for col in row if is_local(col) and not _is_missing(row[col])}
+            if len(cp)>0:
+                groups.setdefault(tuple(cp),[]).append((pos,cp))
+        if len(groups)==0:
+            return ret
 
-        return self.read()
+        column_identity = self.get_identity()[0]
+        with self.engine.begin() as conn:
+            for columns in groups:
+                group_rows = [row for _,row in groups[columns]]
+                ids = None
+                if method == 'copy':
+                    ids = self._insert_copy(conn,columns,group_rows,column_identity,batch_size)
+                if ids is None:
+                    ids = self._insert_values(conn,columns,group_rows,column_identity,batch_size)
+                for (pos,_),id_new in zip(groups[columns],ids):
+                    ret[pos] = id_new
+        self._invalidate_snapshot()
+        return ret
 
     def append(self,**kwarg:Any):
         return self.upload_appends(kwarg)
     
+    def install_change_trigger(self,channel:str='pyplus_changes'):
+        '''
+        Create a statement-level trigger which NOTIFYs channel with 'schema_name.table_name'
+        after INSERT, UPDATE, DELETE or TRUNCATE.
+
+        See Also
+        --------
+        listen_changes
+        '''
+        with self.engine.begin() as conn:
+            conn.execute(text(f'''
+            CREATE OR REPLACE FUNCTION {self.schema_name}.pyplus_notify_change() RETURNS trigger
+            LANGUAGE plpgsql AS $$
+            BEGIN
+                PERFORM pg_notify(TG_ARGV[0],TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME);
+                RETURN NULL;
+            END;
+            $$;
+            '''))
+            conn.execute(text(f'DROP TRIGGER IF EXISTS pyplus_notify_change ON {self.schema_name}.{self.table_name};'))
+            conn.execute(text(f'''
+            CREATE TRIGGER pyplus_notify_change
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {self.schema_name}.{self.table_name}
+            FOR EACH STATEMENT EXECUTE FUNCTION {self.schema_name}.pyplus_notify_change('{channel}');
+            '''))
+
+    def drop_change_trigger(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f'DROP TRIGGER IF EXISTS pyplus_notify_change ON {self.schema_name}.{self.table_name};'))
+
     def connect_foreign_column(self,ts_foreign:Self,local_col:str):
         stmt=text(f'''
         ALTER TABLE IF EXISTS {self.schema_name}.{self.table_name}
@@ -473,37 +2392,862 @@ class TableStructure:
         with self.engine.connect() as conn:
             conn.execute(stmt)
             conn.commit()
+        self.refresh()
     
     #delete
     def delete_column(self, column:str):
+        self.delete_columns(column)
+    @_traced
+    def delete_columns(self,*columns:str):
+        if len(columns) == 0:
+            return
+        clauses = ','.join([f'DROP COLUMN IF EXISTS {column}' for column in columns])
         stmt=text(f'''ALTER TABLE IF EXISTS {self.schema_name}.{self.table_name}
-        DROP COLUMN IF EXISTS {column};''')
+        {clauses};''')
         with self.engine.connect() as conn:
             conn.execute(stmt)
             conn.commit()
-    def delete_columns(self,*columns:str):
-        for column in columns:
-            self.delete_column(column)
+        self.refresh()
 
+    @_traced
     def delete_row(self,row:int):
-        column_identity = chpo.CheckPointFunction(self._iter_read).get_identity()
+        column_identity = self.get_identity()
         stmt=text(f'''DELETE FROM {self.schema_name}.{self.table_name}
-                  WHERE {column_identity[0]}={row};
+                  WHERE "{column_identity[0]}" = :id_row;
                   ''')
         with self.engine.connect() as conn:
-            conn.execute(stmt)
+            conn.execute(stmt,{'id_row':_to_db_param(row)})
+            _lookup_changed(conn,self,deleted=[_to_db_param(row)])
             conn.commit()
-    def delete_rows(self,*rows:int):
-        for row in rows:
-            self.delete_row(row)
+        self._invalidate_snapshot()
+    @_traced
+    def delete_rows(self,*rows:int,batch_size:int=10000)->int:
+        '''
+        Delete rows by ids in one transaction.
+
+        Parameters
+        ----------
+        rows : int
+            Ids of rows.
+        batch_size : int
+            The number of ids in one DELETE statement.
+
+        Returns
+        --------
+        int
+            The number of deleted rows.
+        '''
+        column_identity = self.get_identity()
+        stmt=text(f'''DELETE FROM {self.schema_name}.{self.table_name}
+                  WHERE "{column_identity[0]}" = ANY(:ids);
+                  ''')
+        ids = [_to_db_param(row) for row in rows]
+        count = 0
+        with self.engine.begin() as conn:
+            for start in range(0,len(ids),batch_size):
+                count += conn.execute(stmt,{'ids':ids[start:start+batch_size]}).rowcount
+            _lookup_changed(conn,self,deleted=ids)
+        self._invalidate_snapshot()
+        return count
     
     def delete_table(self):
         stmt=text(f'''DROP TABLE IF EXISTS {self.schema_name}.{self.table_name};''')
         with self.engine.connect() as conn:
             conn.execute(stmt)
             conn.commit()
+        self.refresh()
 
 Table = TableStructure
+
+def _export_partition(url:str,schema_name:str,table_name:str,dtype_backend:Literal['numpy_nullable','pyarrow'],
+                      snapshot_id:str,condition:str,params:dict[str,Any],expand:bool,remove_original_id:bool,
+                      selfref:Literal['wide','path'],path:str|None)->pd.DataFrame|str:
+    '''
+    Read one partition of TableStructure.export in a worker process.
+    '''
+    engine = sqlalchemy.create_engine(url,poolclass=sqlalchemy.pool.NullPool,isolation_level='REPEATABLE READ')
+    def set_snapshot(conn:sqlalchemy.Connection):
+        #the first statement of every transaction, so that the catalog and foreign tables are read in the snapshot too
+        cursor = conn.connection.dbapi_connection.cursor()
+        cursor.execute(f"SET TRANSACTION SNAPSHOT '{snapshot_id}'")
+        cursor.close()
+    sqlalchemy.event.listen(engine,'begin',set_snapshot)
+    ts = TableStructure(schema_name,table_name,engine,dtype_backend)
+    try:
+        if expand:
+            df_content = ts._read_where_expanded(condition,params,remove_original_id,selfref)
+        else:
+            with engine.connect() as conn:
+                stmt = text(f'SELECT t0.* FROM {schema_name}.{table_name} AS t0 WHERE {condition}')
+                df_content = ts._read_typed(conn,stmt,params)
+    finally:
+        engine.dispose()
+    if path is None:
+        return df_content
+    df_content.to_parquet(path)
+    return path
+
+def _lookup_key(val:Any)->Any:
+    val = _to_db_param(val)
+    if isinstance(val,list):
+        return tuple([_lookup_key(v) for v in val])
+    return val
+
+class LookupIndex:
+    '''
+    Value <-> id of one column of a table, read once by SELECT id, column and kept in sync by writes of this library.
+
+    Writes of other clients are not seen until refresh().
+    If max_rows is given and pg_class.reltuples estimates more rows, nothing is cached
+    and every lookup queries WHERE column = ANY(:vals) or WHERE id = ANY(:ids) instead.
+    When some rows share a value, the largest id wins like get_local_val_to_id.
+
+    Examples
+    --------
+    >>> lookup = ts_fruit.get_lookup('color')
+    >>> lookup.get_id('red')
+    >>> lookup.get_ids(['red','green'])
+    >>> ts_basket.get_lookup('fruit_id').get_value(3)
+    '''
+    def __init__(self,ts:TableStructure,column:str,max_rows:int|None=None):
+        self.schema_name = ts.schema_name
+        self.table_name = ts.table_name
+        self.column = column
+        self.max_rows = max_rows
+        self._val_to_ids : dict[Any,set[Any]]|None = None
+        self._id_to_val : dict[Any,Any]|None = None
+        self._too_large = False
+        self._lock = threading.RLock()
+        self._engine = weakref.ref(ts.engine) #indexes are kept by engine, so that they must not keep it alive
+
+    @property
+    def ts(self)->TableStructure:
+        engine = self._engine()
+        if engine is None:
+            raise ReferenceError(f'The engine of {self.schema_name}.{self.table_name} is garbage collected.')
+        return TableStructure(self.schema_name,self.table_name,engine)
+
+    @property
+    def cached(self)->bool:
+        return self._load()
+
+    def _load(self)->bool:
+        with self._lock:
+            if self._id_to_val is not None:
+                return True
+            if self._too_large:
+                return False
+            ts = self.ts
+            with ts.engine.connect() as conn:
+                if self.max_rows is not None:
+                    estimate = conn.execute(text('SELECT reltuples FROM pg_class WHERE oid = to_regclass(:table)'),
+                                            {'table':f'{ts.schema_name}.{ts.table_name}'}).scalar()
+                    if estimate is not None and estimate > self.max_rows:
+                        self._too_large = True
+                        return False
+                with _span('lookup.load',table=f'{ts.schema_name}.{ts.table_name}',column=self.column):
+                    result = conn.execute(text(f'''
+                    SELECT "{ts.get_identity()[0]}","{self.column}" FROM {ts.schema_name}.{ts.table_name};
+                    '''))
+                    id_to_val = {id_row:_lookup_key(val) for id_row,val in result}
+            val_to_ids : dict[Any,set[Any]] = {}
+            for id_row,val in id_to_val.items():
+                if val is not None:
+                    val_to_ids.setdefault(val,set()).add(id_row)
+            self._id_to_val, self._val_to_ids = id_to_val, val_to_ids
+            return True
+
+    def refresh(self):
+        '''
+        Forget the cache so that the next lookup reads the table again.
+        '''
+        with self._lock:
+            self._val_to_ids = None
+            self._id_to_val = None
+            self._too_large = False
+
+    def _apply(self,rows:dict[Any,dict[str,Any]]|None=None,deleted:Iterable[Any]=()):
+        with self._lock:
+            if self._id_to_val is None or self._val_to_ids is None:
+                return
+            for id_row in deleted:
+                self._remove(id_row)
+            for id_row,row in (rows or {}).items():
+                if self.column not in row:
+                    continue
+                id_row = _to_db_param(id_row)
+                self._remove(id_row)
+                val = _lookup_key(row[self.column])
+                self._id_to_val[id_row] = val
+                if val is not None:
+                    self._val_to_ids.setdefault(val,set()).add(id_row)
+
+    def _remove(self,id_row:Any):
+        assert self._id_to_val is not None and self._val_to_ids is not None
+        val = self._id_to_val.pop(id_row,None)
+        if val is not None:
+            self._val_to_ids[val].discard(id_row)
+            if len(self._val_to_ids[val]) == 0:
+                del self._val_to_ids[val]
+
+    def get_id(self,val:Any)->Any:
+        '''
+        An id of a row whose column is val, or None.
+        '''
+        return self.get_ids([val]).get(_lookup_key(val))
+
+    def get_ids(self,vals:Iterable[Any])->dict[Any,Any]:
+        '''
+        Ids by value. Values not in the table are left out.
+        '''
+        keys = list(dict.fromkeys([_lookup_key(val) for val in vals]))
+        with self._lock:
+            if self._load():
+                assert self._val_to_ids is not None
+                return {key:max(self._val_to_ids[key]) for key in keys if key in self._val_to_ids}
+        ts = self.ts
+        identity = ts.get_identity()[0]
+        with ts.engine.connect() as conn:
+            result = conn.execute(text(f'''
+            SELECT "{self.column}","{identity}" FROM {ts.schema_name}.{ts.table_name}
+            WHERE "{self.column}" = ANY(:vals)
+            ORDER BY "{identity}";
+            '''),{'vals':[key for key in keys if key is not None]})
+            return {_lookup_key(val):id_row for val,id_row in result}
+
+    def get_value(self,id_row:Any)->Any:
+        '''
+        A value of the column at id_row, or None.
+        '''
+        return self.get_values([id_row]).get(_to_db_param(id_row))
+
+    def get_values(self,ids:Iterable[Any])->dict[Any,Any]:
+        '''
+        Values by id. Ids not in the table are left out.
+        '''
+        ids = [_to_db_param(id_row) for id_row in ids]
+        with self._lock:
+            if self._load():
+                assert self._id_to_val is not None
+                return {id_row:self._id_to_val[id_row] for id_row in ids if id_row in self._id_to_val}
+        ts = self.ts
+        identity = ts.get_identity()[0]
+        with ts.engine.connect() as conn:
+            result = conn.execute(text(f'''
+            SELECT "{identity}","{self.column}" FROM {ts.schema_name}.{ts.table_name}
+            WHERE "{identity}" = ANY(:ids);
+            '''),{'ids':ids})
+            return {id_row:_lookup_key(val) for id_row,val in result}
+
+    def to_dict(self)->dict[Any,Any]:
+        '''
+        Ids by every non-null value.
+        '''
+        with self._lock:
+            if self._load():
+                assert self._val_to_ids is not None
+                return {val:max(ids) for val,ids in self._val_to_ids.items()}
+        ts = self.ts
+        identity = ts.get_identity()[0]
+        with ts.engine.connect() as conn:
+            result = conn.execute(text(f'''
+            SELECT "{self.column}","{identity}" FROM {ts.schema_name}.{ts.table_name}
+            WHERE "{self.column}" IS NOT NULL
+            ORDER BY "{identity}";
+            '''))
+            return {_lookup_key(val):id_row for val,id_row in result}
+
+_lookup_indexes : weakref.WeakKeyDictionary[sqlalchemy.Engine,dict[tuple[str,str],dict[str,LookupIndex]]] = weakref.WeakKeyDictionary()
+_lookup_indexes_lock = threading.Lock()
+_lookup_info_key = 'pyplus_lookup_changes'
+
+def _get_lookup(ts:TableStructure,column:str,max_rows:int|None=None)->LookupIndex:
+    with _lookup_indexes_lock:
+        if not sqlalchemy.event.contains(sqlalchemy.Engine,'commit',_apply_lookup_changes):
+            sqlalchemy.event.listen(sqlalchemy.Engine,'commit',_apply_lookup_changes)
+            sqlalchemy.event.listen(sqlalchemy.Engine,'rollback',_discard_lookup_changes)
+        indexes = _lookup_indexes.setdefault(ts.engine,{}).setdefault((ts.schema_name,ts.table_name),{})
+        if column not in indexes:
+            indexes[column] = LookupIndex(ts,column,max_rows)
+        elif max_rows is not None and indexes[column].max_rows != max_rows:
+            indexes[column].max_rows = max_rows
+            indexes[column].refresh()
+        return indexes[column]
+
+def _lookups_of(ts:TableStructure)->list[LookupIndex]:
+    indexes = _lookup_indexes.get(ts.engine)
+    if indexes is None:
+        return []
+    return list(indexes.get((ts.schema_name,ts.table_name),{}).values())
+
+def _lookup_changed(conn:sqlalchemy.Connection,ts:TableStructure,
+                    rows:dict[Any,dict[str,Any]]|None=None,deleted:Iterable[Any]=()):
+    '''
+    Hold rows written or deleted on conn until commit, then apply them to lookup indexes of the table.
+    '''
+    lookups = _lookups_of(ts)
+    if len(lookups) > 0:
+        conn.info.setdefault(_lookup_info_key,[]).append((lookups,rows,list(deleted)))
+
+def _apply_lookup_changes(conn:sqlalchemy.Connection):
+    changes = conn.info.pop(_lookup_info_key,[])
+    for lookups,rows,deleted in changes:
+        for lookup in lookups:
+            lookup._apply(rows,deleted)
+    listener = _listeners.get(conn.engine)
+    if listener is not None and len(changes) > 0:
+        listener._note_own(conn.connection.dbapi_connection,
+                           {(lookup.schema_name,lookup.table_name) for lookups,_,_ in changes for lookup in lookups})
+
+def _discard_lookup_changes(conn:sqlalchemy.Connection):
+    conn.info.pop(_lookup_info_key,None)
+
+def _refresh_lookups(ts:TableStructure):
+    for lookup in _lookups_of(ts):
+        lookup.refresh()
+
+def _missing_name(values:Iterable[Any])->str:
+    for val in values:
+        if _is_missing(val):
+            return 'NaT' if val is pd.NaT else 'NA' if val is pd.NA else 'nan' if isinstance(val,float) else 'None'
+    return 'None'
+
+_missing_values = {'NaT':pd.NaT,'NA':pd.NA,'nan':np.nan,'None':None}
+
+class DiskCache:
+    '''
+    Reads of tables saved as Arrow IPC or Parquet files in a directory and shared by processes.
+
+    An entry is keyed by the table, the arguments of the read, column types and foreign keys of every table in its
+    foreign-key tree, and a change version of those tables read by one query before every cached read.
+    A file is written to a temporary name and renamed, so that readers see a whole file or none.
+    Reads of Arrow IPC files are memory-mapped.
+    The least recently read files are removed when the directory grows beyond max_bytes.
+
+    Parameters
+    ----------
+    directory : str
+        A directory of cache files, created if missing.
+    max_bytes : int
+        The total size of cache files to keep.
+    version : {'xmin','stats'}
+        'xmin' counts rows and sums hashes of ctid and xmin of every table, which changes at every committed insert,
+        update or delete barring hash collisions, but scans every table of the foreign-key tree in full before each read.
+        'stats' reads counters of pg_stat_user_tables, which is free but may lag behind commits of other sessions.
+    format : {'arrow','parquet'}
+        A file format. Parquet files are smaller and Arrow IPC files are faster to read.
+
+    Attributes
+    ----------
+    hits, misses : int
+        Cached reads of this process.
+    '''
+    def __init__(self,directory:str,max_bytes:int=2**30,version:Literal['xmin','stats']='xmin',
+                 format:Literal['arrow','parquet']='arrow'):
+        os.makedirs(directory,exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version
+        self.format = format
+        self.hits = 0
+        self.misses = 0
+
+    def _tables(self,ts:TableStructure)->list[TableStructure]:
+        key = (ts.schema_name,ts.table_name)
+        referred = _get_cached_graph(ts.engine,key).get_referred(*key)
+        return [ts]+[TableStructure(*ft,ts.engine,ts.dtype_backend) for ft in sorted(referred)]
+
+    def _query_version(self,conn:sqlalchemy.Connection,tables:list[TableStructure])->list[tuple]:
+        names = [f'{ts.schema_name}.{ts.table_name}' for ts in tables]
+        match self.version:
+            case 'xmin':
+                #every insert, update or delete gives a row version a new ctid and xmin
+                stmt = ' UNION ALL '.join([f"SELECT {num},count(*),sum(hashtext(ctid::text||':'||xmin::text)) FROM {name}"
+                                           for num,name in enumerate(names)])
+                return [tuple(row) for row in conn.execute(text(f'{stmt} ORDER BY 1'))]
+            case 'stats':
+                return [tuple(row) for row in conn.execute(text('''
+                SELECT relid::regclass::text,n_tup_ins,n_tup_upd,n_tup_del
+                FROM pg_stat_user_tables
+                WHERE relid = ANY(CAST(:tables AS regclass[]))
+                ORDER BY 1;
+                '''),{'tables':names})]
+            case _:
+                raise NotImplementedError(f'{self.version} is not supported.')
+
+    def fetch(self,ts:TableStructure,kind:str,args:dict[str,Any],read:Callable[[],pd.DataFrame])->pd.DataFrame:
+        '''
+        Load a read of ts from a file of the current version, or call read and save it.
+        '''
+        tables = self._tables(ts)
+        key = repr((kind,sorted(args.items()),ts.dtype_backend,
+                    [(ft.schema_name,ft.table_name,ft._catalog('types',_query_types).to_dict(),
+                      ft._catalog('foreign',_query_foreign)) for ft in tables]))
+        with ts.engine.connect() as conn:
+            version = repr(self._query_version(conn,tables))
+        prefix = f'{ts.schema_name}.{ts.table_name}.{hashlib.sha1(key.encode()).hexdigest()[:16]}.'
+        path = os.path.join(self.directory,f'{prefix}{hashlib.sha1(version.encode()).hexdigest()[:16]}.{self.format}')
+        with _span('disk_cache',table=f'{ts.schema_name}.{ts.table_name}') as span:
+            df_content = self._load(path,ts.dtype_backend)
+            if span is not None:
+                span.attributes['hit'] = df_content is not None
+        if df_content is not None:
+            self.hits += 1
+            return df_content
+        self.misses += 1
+        df_content = read()
+        self._save(path,prefix,df_content)
+        return df_content
+
+    def _load(self,path:str,dtype_backend:str)->pd.DataFrame|None:
+        import pyarrow as pa
+        try:
+            if self.format == 'arrow':
+                table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+            else:
+                import pyarrow.parquet as pq
+                table = pq.read_table(path,memory_map=True)
+            os.utime(path) #the modified time orders eviction
+        except FileNotFoundError:
+            return None
+        metadata = json.loads(table.schema.metadata[b'pyplus'])
+        df_content = table.to_pandas(types_mapper=pd.ArrowDtype if dtype_backend == 'pyarrow' else None)
+        #Arrow has no object dtype, so values of object columns are rebuilt as Python objects
+        for col,missing in metadata['objects'].items():
+            values = [_missing_values[missing] if val is None else val for val in table.column(col).to_pylist()]
+            df_content[col] = pd.Series(values,index=df_content.index,dtype=object)
+        df_content.index = df_content.index.astype(metadata['index'])
+        return df_content
+
+    def _save(self,path:str,prefix:str,df_content:pd.DataFrame):
+        import pyarrow as pa
+        metadata = {'index':str(df_content.index.dtype),
+                    'objects':{col:_missing_name(df_content[col]) for col in df_content.columns 
+                               if df_content[col].dtype == object}}
+        try:
+            table = pa.Table.from_pandas(df_content,preserve_index=True)
+        except (pa.ArrowInvalid,pa.ArrowTypeError,pa.ArrowNotImplementedError):
+            return #values which Arrow cannot hold are not cached
+        table = table.replace_schema_metadata((table.schema.metadata or {})|{b'pyplus':json.dumps(metadata).encode()})
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        if self.format == 'arrow':
+            with pa.OSFile(tmp,'wb') as sink, pa.ipc.new_file(sink,table.schema) as writer:
+                writer.write_table(table)
+        else:
+            import pyarrow.parquet as pq
+            pq.write_table(table,tmp)
+        os.replace(tmp,path)
+        for name in os.listdir(self.directory):
+            #older versions of the same entry
+            if name.startswith(os.path.basename(prefix)) and name != os.path.basename(path) and not name.endswith('.tmp'):
+                self._remove(os.path.join(self.directory,name))
+        self.evict()
+
+    def _remove(self,path:str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        '''
+        Remove the least recently read files until the directory holds max_bytes or less.
+        '''
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(('.arrow','.parquet')):
+                try:
+                    stat = os.stat(os.path.join(self.directory,name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime,stat.st_size,os.path.join(self.directory,name)))
+        total = sum([size for _,size,_ in entries])
+        for _,size,path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(('.arrow','.parquet')):
+                self._remove(os.path.join(self.directory,name))
+
+_disk_caches : weakref.WeakKeyDictionary[sqlalchemy.Engine,DiskCache] = weakref.WeakKeyDictionary()
+
+def enable_disk_cache(engine:sqlalchemy.Engine,directory:str,max_bytes:int=2**30,
+                      version:Literal['xmin','stats']='xmin',format:Literal['arrow','parquet']='arrow')->DiskCache:
+    '''
+    Cache read() and read_expand() without columns, filters, order or limit of every TableStructure of engine in files.
+
+    See Also
+    --------
+    DiskCache
+
+    Examples
+    --------
+    >>> enable_disk_cache(eng,'/tmp/pyplus_cache',max_bytes=10*2**30)
+    >>> ts.read_expand() #the second process reading this only checks the version
+    '''
+    _disk_caches[engine] = DiskCache(directory,max_bytes,version,format)
+    return _disk_caches[engine]
+
+def disable_disk_cache(engine:sqlalchemy.Engine):
+    _disk_caches.pop(engine,None)
+
+_pinned_tables : weakref.WeakSet[TableStructure] = weakref.WeakSet() #tables with a pinned snapshot
+
+def _invalidate_cached(engine:sqlalchemy.Engine,schema_name:str,table_name:str,lookups=True):
+    for ts in list(_pinned_tables):
+        if ts.engine is engine and ts.schema_name == schema_name and ts.table_name == table_name:
+            ts._invalidate_snapshot()
+    if lookups:
+        for lookup in list(_lookup_indexes.get(engine,{}).get((schema_name,table_name),{}).values()):
+            lookup.refresh()
+
+class ChangeListener:
+    '''
+    A background thread which LISTENs on one connection of an engine for notifications of
+    TableStructure.install_change_trigger, and marks caches of the changed table and of tables referring to it dirty.
+
+    Pinned snapshots are invalidated, lookup indexes are refreshed, versions are counted up and callbacks are called.
+    Lookup indexes skip a notification only when the notifying transaction already applied its writes
+    of that table to them at commit, and are refreshed for any other write.
+    After a lost connection, the listener connects again and marks every table dirty.
+
+    Parameters
+    ----------
+    engine : sqlalchemy.Engine
+        An engine of psycopg2 or psycopg.
+    channel : str
+        A channel given to install_change_trigger.
+    timeout : float
+        Seconds to wait for notifications before checking stop().
+
+    Attributes
+    ----------
+    versions : dict[tuple[str,str],int]
+        The number of notified changes by (schema_name, table_name), counting changes of referred tables.
+    '''
+    def __init__(self,engine:sqlalchemy.Engine,channel:str='pyplus_changes',timeout:float=1.0):
+        self._engine = weakref.ref(engine) #the thread ends when the engine is garbage collected
+        self.channel = channel
+        self.timeout = timeout
+        self.versions : dict[tuple[str,str],int] = {}
+        self._callbacks : list[Callable[[str,str],Any]] = []
+        self._own : dict[tuple[int,str,str],list[float]] = {} #commit times by (backend pid, schema_name, table_name)
+        self._own_lock = threading.Lock()
+        self._graph : SchemaGraph|None = None
+        self._stopped = threading.Event()
+        self._conn = self._connect()
+        self._thread = threading.Thread(target=self._run,name=f'pyplus-listener-{channel}',daemon=True)
+        self._thread.start()
+
+    @property
+    def engine(self)->sqlalchemy.Engine:
+        engine = self._engine()
+        if engine is None:
+            raise ReferenceError(f'The engine of {self.channel} listener is garbage collected.')
+        return engine
+
+    def _connect(self):
+        #outside the pool of the engine, since a pool refers to its engine through connect events
+        dialect = self.engine.dialect
+        cargs, cparams = dialect.create_connect_args(self.engine.url)
+        dbapi_conn = dialect.connect(*cargs,**cparams)
+        if not hasattr(dbapi_conn,'poll') and not callable(getattr(dbapi_conn,'notifies',None)):
+            dbapi_conn.close()
+            raise NotImplementedError(f'{type(dbapi_conn)} is not supported. Use psycopg2 or psycopg.')
+        dbapi_conn.autocommit = True
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f'LISTEN "{self.channel}";')
+        cursor.close()
+        return dbapi_conn
+
+    def _note_own(self,dbapi_conn,tables:Iterable[tuple[str,str]]):
+        pid = getattr(getattr(dbapi_conn,'info',None),'backend_pid',None)
+        if pid is None:
+            return
+        now = time.monotonic()
+        with self._own_lock:
+            for key in [key for key,times in self._own.items() if now-times[-1] > 60]: #tables without the trigger
+                del self._own[key]
+            for schema_name,table_name in tables:
+                self._own.setdefault((pid,schema_name,table_name),[]).append(now)
+
+    def _is_own(self,pid:int,schema_name:str,table_name:str)->bool:
+        key = (pid,schema_name,table_name)
+        with self._own_lock:
+            if key not in self._own:
+                return False
+            self._own[key].pop(0)
+            if len(self._own[key]) == 0:
+                del self._own[key]
+            return True
+
+    def _notifications(self)->Iterator[tuple[int,str]]:
+        dbapi_conn = self._conn
+        if hasattr(dbapi_conn,'poll'): #psycopg2
+            if select.select([dbapi_conn],[],[],self.timeout)[0]:
+                dbapi_conn.poll()
+                while dbapi_conn.notifies:
+                    notify = dbapi_conn.notifies.pop(0)
+                    yield notify.pid, notify.payload
+        else: #psycopg
+            for notify in dbapi_conn.notifies(timeout=self.timeout):
+                yield notify.pid, notify.payload
+
+    def _run(self):
+        while not self._stopped.is_set() and self._engine() is not None:
+            try:
+                for pid,payload in self._notifications():
+                    schema_name, _, table_name = payload.partition('.')
+                    self._mark_dirty(schema_name,table_name,own=self._is_own(pid,schema_name,table_name))
+            except Exception as err:
+                if self._stopped.is_set():
+                    break
+                warn(f'{self.channel} listener lost its connection: {err}')
+                self._stopped.wait(self.timeout)
+                try:
+                    self._close()
+                    self._conn = self._connect()
+                except Exception:
+                    continue
+                self._mark_all_dirty()
+        if not self._stopped.is_set():
+            self._close()
+
+    def _close(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+    def _dependents(self,schema_name:str,table_name:str)->set[tuple[str,str]]:
+        if self._graph is None or (schema_name,table_name) not in self._graph.tables:
+            self._graph = get_schema_graph(self.engine)
+        return self._graph.get_dependents(schema_name,table_name)
+
+    def _mark_dirty(self,schema_name:str,table_name:str,own=False):
+        for key in [(schema_name,table_name),*self._dependents(schema_name,table_name)]:
+            self.versions[key] = self.versions.get(key,0)+1
+            _invalidate_cached(self.engine,*key,lookups=not own)
+            for callback in list(self._callbacks):
+                try:
+                    callback(*key)
+                except Exception as err:
+                    warn(f'A callback of {self.channel} listener failed: {err!r}')
+
+    def _mark_all_dirty(self):
+        self._graph = None
+        keys = {(ts.schema_name,ts.table_name) for ts in list(_pinned_tables) if ts.engine is self.engine}
+        keys |= set(_lookup_indexes.get(self.engine,{}))
+        for key in keys:
+            self._mark_dirty(*key)
+
+    def subscribe(self,callback:Callable[[str,str],Any])->Callable[[str,str],Any]:
+        '''
+        Call callback(schema_name, table_name) on the listener thread for every dirty table.
+        '''
+        self._callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self,callback:Callable[[str,str],Any]):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def refresh(self):
+        '''
+        Read foreign keys again at the next notification, after tables or foreign keys are changed.
+        '''
+        self._graph = None
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self._close()
+        engine = self._engine()
+        if engine is not None and _listeners.get(engine) is self:
+            del _listeners[engine]
+
+_listeners : weakref.WeakKeyDictionary[sqlalchemy.Engine,ChangeListener] = weakref.WeakKeyDictionary()
+_listeners_lock = threading.Lock()
+
+def listen_changes(engine:sqlalchemy.Engine,channel:str='pyplus_changes',timeout:float=1.0)->ChangeListener:
+    '''
+    Start the change listener of an engine, or get the running one.
+
+    See Also
+    --------
+    ChangeListener
+    TableStructure.install_change_trigger
+    SchemaStructure.install_change_triggers
+
+    Examples
+    --------
+    >>> SchemaStructure('public',eng).install_change_triggers()
+    >>> listener = listen_changes(eng)
+    >>> listener.subscribe(lambda schema_name,table_name: print(schema_name,table_name))
+    '''
+    with _listeners_lock:
+        if engine not in _listeners:
+            _listeners[engine] = ChangeListener(engine,channel,timeout)
+        return _listeners[engine]
+
+class SessionTable:
+    '''
+    Edits of one table buffered in a Session.
+    '''
+    def __init__(self,uow:'Session',ts:TableStructure):
+        self.session = uow
+        self.ts = ts
+
+    def upload(self,id_row:int,**kwarg:Any):
+        self.session._upload(self.ts,id_row,kwarg)
+
+    def upload_dataframe(self,df:pd.DataFrame):
+        dict_df = df.to_dict('index')
+        for id_row in dict_df:
+            self.session._upload(self.ts,id_row,dict_df[id_row])
+
+    def append(self,**kwarg:Any):
+        self.session._append(self.ts,kwarg)
+
+    def upload_appends(self,*row:dict[str,Any]):
+        for kwarg in row:
+            self.session._append(self.ts,kwarg)
+
+    def delete_row(self,row:int):
+        self.session._delete(self.ts,[row])
+
+    def delete_rows(self,*rows:int):
+        self.session._delete(self.ts,list(rows))
+
+class Session:
+    '''
+    A unit of work which buffers uploads, appends and deletes of tables in memory and flushes them in one transaction.
+
+    Edits of the same cell are coalesced and an upload of a row deleted in the session is dropped.
+    Flush inserts rows of referred tables first, then updates rows, then deletes rows of referring tables first,
+    each batched per table.
+
+    Attributes
+    ----------
+    inserted : dict[tuple[str,str],list[int]]
+        Ids of appended rows by (schema_name, table_name) after flush.
+
+    Examples
+    --------
+    >>> with session(eng) as uow:
+    ...     uow.table(ts_fruit).append(color='red')
+    ...     uow.table(ts_basket).upload(1,qty=3)
+    >>> uow.inserted
+    '''
+    def __init__(self,engine:sqlalchemy.Engine,batch_size:int=1000):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.inserted : dict[tuple[str,str],list[int]] = {}
+        self._tables : dict[tuple[str,str],TableStructure] = {}
+        self._updates : dict[tuple[str,str],dict[Any,dict[str,Any]]] = {}
+        self._inserts : dict[tuple[str,str],list[dict[str,Any]]] = {}
+        self._deletes : dict[tuple[str,str],set[Any]] = {}
+
+    def table(self,ts:TableStructure)->SessionTable:
+        return SessionTable(self,ts)
+
+    def _key(self,ts:TableStructure)->tuple[str,str]:
+        key = (ts.schema_name,ts.table_name)
+        self._tables.setdefault(key,ts)
+        return key
+
+    def _upload(self,ts:TableStructure,id_row:Any,kwarg:dict[str,Any]):
+        key = self._key(ts)
+        id_row = _to_db_param(id_row)
+        if id_row not in self._deletes.get(key,set()):
+            self._updates.setdefault(key,{}).setdefault(id_row,{}).update(kwarg)
+
+    def _append(self,ts:TableStructure,kwarg:dict[str,Any]):
+        self._inserts.setdefault(self._key(ts),[]).append(dict(kwarg))
+
+    def _delete(self,ts:TableStructure,rows:list[Any]):
+        key = self._key(ts)
+        ids = {_to_db_param(row) for row in rows}
+        self._deletes.setdefault(key,set()).update(ids)
+        for id_row in ids:
+            self._updates.get(key,{}).pop(id_row,None)
+
+    def _load_order(self)->list[tuple[str,str]]:
+        try:
+            return _get_cached_graph(self.engine,*self._tables).load_order(self._tables)
+        except graphlib.CycleError:
+            return list(self._tables)
+
+    def discard(self):
+        '''
+        Forget every buffered edit.
+        '''
+        self._updates.clear()
+        self._inserts.clear()
+        self._deletes.clear()
+
+    def flush(self)->dict[tuple[str,str],list[int]]:
+        '''
+        Write every buffered edit in one transaction, rolled back as a whole on error.
+
+        Returns
+        --------
+        dict[tuple[str,str],list[int]]
+            Ids of appended rows by (schema_name, table_name).
+        '''
+        with _span('Session.flush'):
+            return self._flush()
+
+    def _flush(self)->dict[tuple[str,str],list[int]]:
+        order = self._load_order()
+        inserted : dict[tuple[str,str],list[int]] = {}
+        with self.engine.begin() as conn:
+            for key in order:
+                if len(self._inserts.get(key,[]))>0:
+                    inserted[key] = self._tables[key]._insert_rows(conn,self._inserts[key],self.batch_size)
+            for key in order:
+                if len(self._updates.get(key,{}))>0:
+                    self._tables[key]._update_rows(conn,self._updates[key],self.batch_size)
+            for key in reversed(order):
+                if len(self._deletes.get(key,set()))>0:
+                    ts = self._tables[key]
+                    stmt = text(f'''DELETE FROM {ts.schema_name}.{ts.table_name}
+                              WHERE "{ts.get_identity()[0]}" = ANY(:ids);
+                              ''')
+                    ids = list(self._deletes[key])
+                    for start in range(0,len(ids),self.batch_size):
+                        conn.execute(stmt,{'ids':ids[start:start+self.batch_size]})
+                    _lookup_changed(conn,ts,deleted=ids)
+        for ts in self._tables.values():
+            ts._invalidate_snapshot()
+        self.discard()
+        self.inserted = inserted
+        return inserted
+
+@contextmanager
+def session(engine:sqlalchemy.Engine,batch_size:int=1000)->Iterator[Session]:
+    '''
+    Buffer edits of tables of engine in a Session and flush them in one transaction when the block ends.
+
+    Nothing is written if the block raises.
+
+    Examples
+    --------
+    >>> with session(eng) as uow:
+    ...     uow.table(ts_fruit).upload(1,color='red')
+    ...     uow.table(ts_basket).delete_row(3)
+    '''
+    uow = Session(engine,batch_size)
+    try:
+        yield uow
+    except BaseException:
+        uow.discard()
+        raise
+    uow.flush()
     
 def get_table_list(engine:sqlalchemy.Engine):
     '''
@@ -548,6 +3292,23 @@ class SchemaStructure:
         self.engine = engine
 
                 
+    def get_graph(self)->SchemaGraph:
+        '''
+        Read a graph of foreign keys of every table in this schema.
+
+        See Also
+        --------
+        get_schema_graph
+        '''
+        return get_schema_graph(self.engine,self.schema_name)
+
+    def install_change_triggers(self,channel:str='pyplus_changes'):
+        '''
+        Install TableStructure.install_change_trigger on every table of this schema.
+        '''
+        for schema_name,table_name in self.get_graph().tables:
+            TableStructure(schema_name,table_name,self.engine).install_change_trigger(channel)
+
     def execute_sql_write(self,sql):
         with self.engine.connect() as conn:
             conn.execute(sql)
@@ -579,6 +3340,7 @@ class SchemaStructure:
             conn.commit()
 
         ts = TableStructure(self.schema_name,table_name,self.engine)
+        ts.refresh()
         ts.append_column(**type_dict)
         return ts
 
@@ -0,0 +1,210 @@
+'''
+Benchmark of pyplus.sql.oopgplus against a throwaway local PostgreSQL.
+
+initdb creates a cluster in a temporary directory which listens only on a unix socket,
+so nothing goes through the network. initdb refuses to run as root.
+
+Examples
+--------
+$ python -m pyplus.tester.bench_oopgplus --rows 10000 --depth 3 --output bench_output.txt
+$ python -m pyplus.tester.bench_oopgplus --url postgresql+psycopg2://postgres@127.0.0.1:5432/postgres
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any,Callable,Iterator
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import text
+
+from pyplus.sql.oopgplus import TableStructure,create_schema,get_catalog_cache,track_statements
+
+@contextmanager
+def local_postgres(pg_bin:str|None=None,port:int=55439)->Iterator[str]:
+    '''
+    Start PostgreSQL in a temporary directory and yield its URL. The cluster is removed at exit.
+    '''
+    def find(name:str)->str:
+        path = os.path.join(pg_bin,name) if pg_bin is not None else shutil.which(name)
+        if path is None or not os.path.exists(path):
+            raise FileNotFoundError(f'{name} is not found. Give --pg-bin.')
+        return path
+    initdb, pg_ctl = find('initdb'), find('pg_ctl')
+    tmp = tempfile.mkdtemp(prefix='pyplus_bench_')
+    data = os.path.join(tmp,'data')
+    subprocess.run([initdb,'-D',data,'-U','postgres','-A','trust','--no-sync','-E','UTF8'],
+                   check=True,capture_output=True)
+    options = f"-p {port} -k {tmp} -c listen_addresses='' -c fsync=off -c synchronous_commit=off"
+    subprocess.run([pg_ctl,'-D',data,'-o',options,'-l',os.path.join(tmp,'log'),'-w','start'],
+                   check=True,capture_output=True)
+    try:
+        yield f'postgresql+psycopg2://postgres@/postgres?host={tmp}&port={port}'
+    finally:
+        subprocess.run([pg_ctl,'-D',data,'-m','fast','-w','stop'],capture_output=True)
+        shutil.rmtree(tmp,ignore_errors=True)
+
+def build_schema(engine:sqlalchemy.Engine,rows:int,depth:int,width:int,schema_name:str='bench')->list[TableStructure]:
+    '''
+    Create tables level0 -> level1 -> ... -> level{depth-1} linked by foreign keys.
+    The last level refers to itself by parent_id. level0 has rows rows and every other level rows//10.
+
+    Returns
+    --------
+    list[TableStructure]
+        Tables from level0.
+    '''
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS {schema_name} CASCADE'))
+    ss = create_schema(engine,schema_name)
+    tables = []
+    for level in range(depth):
+        type_dict = {f'text{col}':'text' for col in range(width)} | {'num':'integer','day':'date'}
+        tables.append(ss.create_table(f'level{level}',**type_dict))
+    for level in range(depth):
+        ts = tables[level]
+        if level+1 < depth:
+            ts.append_column(next_id='bigint')
+            ts.connect_foreign_column(tables[level+1],'next_id')
+        else:
+            ts.append_column(parent_id='bigint')
+            ts.connect_foreign_column(ts,'parent_id')
+        n = rows if level == 0 else max(10,rows//10)
+        df = pd.DataFrame({f'text{col}':[f'value {col} of {row}' for row in range(n)] for col in range(width)}
+                          | {'num':range(n),'day':[pd.Timestamp('2024-01-01').date()]*n})
+        ts.upload_appends_bulk(df)
+    with engine.begin() as conn:
+        conn.execute(text('SELECT setseed(0.5)'))
+        for level in range(depth):
+            table = f'{schema_name}.level{level}'
+            if level+1 < depth:
+                upper = f'{schema_name}.level{level+1}'
+                conn.execute(text(f'''UPDATE {table} SET next_id = (SELECT min(id) FROM {upper})
+                                  + floor(random()*(SELECT count(*) FROM {upper}))::bigint'''))
+            else:
+                #a forest: every row refers to an earlier row
+                conn.execute(text(f'''UPDATE {table} SET parent_id = CASE WHEN id % 5 = 1 THEN NULL
+                                  ELSE (SELECT min(id) FROM {table}) + floor(random()*(id-(SELECT min(id) FROM {table})))::bigint END'''))
+        conn.execute(text('ANALYZE'))
+    get_catalog_cache(engine).refresh()
+    return tables
+
+def measure(engine:sqlalchemy.Engine,func:Callable[[],Any],rows:int,repeat:int,
+            setup:Callable[[],Any]|None=None)->dict[str,Any]:
+    '''
+    Run func repeat times and report the median latency, rows per second, statements and peak memory of Python.
+
+    The peak memory is taken by one more run which is not timed, since tracemalloc slows down every allocation.
+    '''
+    latencies = []
+    statements = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with track_statements(engine) as stats:
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter()-start)
+        statements.append(stats.statements)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    latency = statistics.median(latencies)
+    return {'latency_s':latency,'latency_min_s':min(latencies),'latency_max_s':max(latencies),
+            'rows':rows,'rows_per_s':rows/latency if latency > 0 else None,
+            'statements':statistics.median(statements),'peak_memory_bytes':peak}
+
+def run(url:str,rows:int,depth:int,width:int,repeat:int,batch:int)->dict[str,Any]:
+    engine = sqlalchemy.create_engine(url)
+    tables = build_schema(engine,rows,depth,width)
+    ts = tables[0]
+    ids = ts.read().index.to_list()
+    results = {}
+
+    results['read'] = measure(engine,ts.read,rows,repeat)
+    results['read_expand'] = measure(engine,ts.read_expand,rows,repeat)
+    results['export'] = measure(engine,lambda: ts.export(),rows,repeat)
+    results['export_expand'] = measure(engine,lambda: ts.export(expand=True),rows,repeat)
+
+    def upload():
+        for id_row in ids[:batch]:
+            ts.upload(id_row,return_mode='none',num=1,text0='uploaded')
+    results['upload'] = measure(engine,upload,batch,repeat)
+
+    def upload_foreign():
+        for id_row in ids[:batch]:
+            ts.upload(id_row,return_mode='none',**{'next_id.text0':'uploaded'})
+    results['upload_foreign'] = measure(engine,upload_foreign,batch,repeat)
+
+    df = pd.DataFrame({'num':range(len(ids)),'text0':['updated']*len(ids)},index=ids)
+    results['upload_dataframe'] = measure(engine,lambda: ts.upload_dataframe(df),len(ids),repeat)
+    df_foreign = pd.DataFrame({'next_id.num':range(batch)},index=ids[:batch])
+    results['upload_dataframe_foreign'] = measure(engine,lambda: ts.upload_dataframe(df_foreign),batch,repeat)
+
+    def clear_appended():
+        with engine.begin() as conn:
+            conn.execute(text(f"DELETE FROM {ts.schema_name}.{ts.table_name} WHERE text0 = 'appended'"))
+    rows_appended = [{'num':row,'text0':'appended'} for row in range(rows)]
+    results['upload_appends'] = measure(engine,lambda: ts.upload_appends(*rows_appended[:batch],return_mode='none'),
+                                        batch,repeat,setup=clear_appended)
+    appended : list[int] = []
+    def upload_appends_bulk():
+        appended[:] = ts.upload_appends_bulk(rows_appended)
+    results['upload_appends_bulk'] = measure(engine,upload_appends_bulk,rows,repeat,setup=clear_appended)
+    def append_again():
+        clear_appended()
+        upload_appends_bulk()
+    results['delete_rows'] = measure(engine,lambda: ts.delete_rows(*appended),rows,1,setup=append_again)
+
+    engine.dispose()
+    return results
+
+def main(argv:list[str]|None=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows',type=int,default=10000,help='rows of the first table')
+    parser.add_argument('--depth',type=int,default=3,help='tables in the chain of foreign keys')
+    parser.add_argument('--width',type=int,default=4,help='text columns of every table')
+    parser.add_argument('--repeat',type=int,default=3)
+    parser.add_argument('--batch',type=int,default=100,help='rows of row-by-row operations')
+    parser.add_argument('--url',help='use this database instead of a local cluster')
+    parser.add_argument('--pg-bin',help='directory of initdb and pg_ctl')
+    parser.add_argument('--output',help='write JSON to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    params = {'rows':args.rows,'depth':args.depth,'width':args.width,'repeat':args.repeat,'batch':args.batch}
+    if args.url is not None:
+        results = run(args.url,**params)
+    else:
+        with local_postgres(args.pg_bin) as url:
+            results = run(url,**params)
+
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    report = {'commit':commit,'python':platform.python_version(),'pandas':pd.__version__,
+              'sqlalchemy':sqlalchemy.__version__,'params':params,'results':results}
+    output = json.dumps(report,indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output,'w') as file:
+            file.write(output)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
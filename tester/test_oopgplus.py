@@ -0,0 +1,302 @@
+import os
+import shutil
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import date,datetime,timezone,timedelta
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import text
+
+from pyplus.sql.oopgplus import (_is_missing,_to_db_param,_to_copy_field,_to_copy_csv,
+                                 SchemaGraph,SchemaStructure,create_schema,get_catalog_cache,listen_changes,session)
+from pyplus.tester.bench_oopgplus import local_postgres
+
+PG_BIN = os.environ.get('PYPLUS_PG_BIN')
+
+class TestIsMissing(unittest.TestCase):
+    def test_missing(self):
+        for val in [None,np.nan,float('nan'),np.float32('nan'),pd.NaT,pd.NA]:
+            self.assertTrue(_is_missing(val),repr(val))
+
+    def test_not_missing(self):
+        for val in [0,0.0,'',False,'NULL',[],np.int64(0),pd.Timestamp('2024-01-01')]:
+            self.assertFalse(_is_missing(val),repr(val))
+
+class TestToDbParam(unittest.TestCase):
+    def test_missing_into_none(self):
+        for val in [np.nan,pd.NaT,pd.NA,None]:
+            self.assertIsNone(_to_db_param(val))
+
+    def test_numpy_scalars(self):
+        for val,expected in [(np.int64(3),3),(np.int32(-1),-1),(np.float64(1.5),1.5),(np.bool_(True),True)]:
+            converted = _to_db_param(val)
+            self.assertEqual(converted,expected)
+            self.assertIs(type(converted),type(expected))
+
+    def test_timestamp_keeps_time_zone(self):
+        converted = _to_db_param(pd.Timestamp('2024-01-02 03:04:05',tz='Asia/Seoul'))
+        self.assertIs(type(converted),datetime)
+        self.assertEqual(converted.utcoffset(),timedelta(hours=9))
+        self.assertEqual(converted,datetime(2024,1,1,18,4,5,tzinfo=timezone.utc))
+
+    def test_naive_timestamp(self):
+        converted = _to_db_param(pd.Timestamp('2024-01-02 03:04:05'))
+        self.assertEqual(converted,datetime(2024,1,2,3,4,5))
+        self.assertIsNone(converted.tzinfo)
+
+    def test_arrays(self):
+        self.assertEqual(_to_db_param(np.array([1,2])),[1,2])
+        self.assertIs(type(_to_db_param(np.array([1,2]))[0]),int)
+        self.assertEqual(_to_db_param(('a',None,np.nan)),['a',None,None])
+        self.assertEqual(_to_db_param([[np.int64(1),pd.NA],[3,4]]),[[1,None],[3,4]])
+
+    def test_others_unchanged(self):
+        for val in ['red',7,date(2024,1,2),b'\x00']:
+            self.assertIs(_to_db_param(val),val)
+
+class TestToCopyField(unittest.TestCase):
+    def test_scalars(self):
+        self.assertIsNone(_to_copy_field(None))
+        self.assertIsNone(_to_copy_field(pd.NaT))
+        self.assertEqual(_to_copy_field(True),'true')
+        self.assertEqual(_to_copy_field(np.bool_(False)),'false')
+        self.assertEqual(_to_copy_field(np.int64(5)),'5')
+        self.assertEqual(_to_copy_field(date(2024,1,2)),'2024-01-02')
+        self.assertEqual(_to_copy_field(pd.Timestamp('2024-01-02 03:04:05',tz='Asia/Seoul')),'2024-01-02T03:04:05+09:00')
+
+    def test_array_escaping(self):
+        self.assertEqual(_to_copy_field(['a','b"c','d\\e',None,'','{z}']),
+                         '{"a","b\\"c","d\\\\e",NULL,"","{z}"}')
+        self.assertEqual(_to_copy_field([]),'{}')
+        self.assertEqual(_to_copy_field(np.array([1,2])),'{"1","2"}')
+
+    def test_multidimensional_array(self):
+        self.assertEqual(_to_copy_field([[1,2],[3,None]]),'{{"1","2"},{"3",NULL}}')
+
+class TestToCopyCsv(unittest.TestCase):
+    def test_null_and_empty_string(self):
+        self.assertEqual(_to_copy_csv([[None,'',pd.NA]]),',"",\n')
+
+    def test_quotes_backslashes_and_lines(self):
+        self.assertEqual(_to_copy_csv([['q"uo\\te\n,line']]),'"q""uo\\te\n,line"\n')
+
+    def test_array_field(self):
+        self.assertEqual(_to_copy_csv([[['b"c','d\\e'],1]]),'"{""b\\""c"",""d\\\\e""}","1"\n')
+
+class TestSchemaGraph(unittest.TestCase):
+    def setUp(self):
+        #basket -> fruit -> origin, category -> category
+        self.graph = SchemaGraph({('s','basket'):{'foreign':{'fruit_id':('s','fruit')}},
+                                  ('s','fruit'):{'foreign':{'origin_id':('s','origin')}},
+                                  ('s','origin'):{'foreign':{}},
+                                  ('s','category'):{'foreign':{'parent_id':('s','category')}}})
+
+    def test_referred(self):
+        self.assertEqual(self.graph.get_referred('s','basket'),{('s','fruit'),('s','origin')})
+        self.assertEqual(self.graph.get_referred('s','category'),set())
+
+    def test_load_order_of_some_tables(self):
+        self.assertEqual(self.graph.load_order([('s','basket'),('s','origin')]),[('s','origin'),('s','basket')])
+        order = self.graph.load_order()
+        self.assertLess(order.index(('s','fruit')),order.index(('s','basket')))
+
+def _can_run_postgres()->bool:
+    initdb = os.path.join(PG_BIN,'initdb') if PG_BIN is not None else shutil.which('initdb')
+    return initdb is not None and os.path.exists(initdb) and os.geteuid() != 0
+
+def _wait(cond,timeout=5.0)->bool:
+    end = time.monotonic()+timeout
+    while time.monotonic() < end:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return False
+
+@contextmanager
+def _statements(engine:sqlalchemy.Engine):
+    statements = []
+    def before_cursor_execute(conn,cursor,statement,parameters,context,executemany):
+        statements.append(statement)
+    sqlalchemy.event.listen(engine,'before_cursor_execute',before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        sqlalchemy.event.remove(engine,'before_cursor_execute',before_cursor_execute)
+
+@unittest.skipUnless(_can_run_postgres(),'initdb is not found (set PYPLUS_PG_BIN) or running as root')
+class PostgresTestCase(unittest.TestCase):
+    '''
+    A cluster of local_postgres shared by tests of a class. Every test starts with a new schema fx of
+    basket -> fruit -> origin and category -> category, where some foreign ids are NULL.
+    '''
+    @classmethod
+    def setUpClass(cls):
+        cls.url = cls.enterClassContext(local_postgres(PG_BIN,port=55442))
+        cls.engine = sqlalchemy.create_engine(cls.url)
+        cls.addClassCleanup(cls.engine.dispose)
+
+    def setUp(self):
+        with self.engine.begin() as conn:
+            conn.execute(text('DROP SCHEMA IF EXISTS fx CASCADE'))
+        get_catalog_cache(self.engine).refresh()
+        ss = create_schema(self.engine,'fx')
+        self.origin = ss.create_table('origin',country='text')
+        self.fruit = ss.create_table('fruit',color='text',qty='integer')
+        self.fruit.append_column(origin_id='bigint')
+        self.fruit.connect_foreign_column(self.origin,'origin_id')
+        self.origin.upload_appends_bulk([{'country':'kr'},{'country':'jp'}])
+        self.fruit.upload_appends_bulk([{'color':'red','qty':1,'origin_id':1},{'color':'yellow','qty':2,'origin_id':2},
+                                        {'color':'green','qty':3}])
+        self.basket = ss.create_table('basket',qty='integer')
+        self.basket.append_column(fruit_id='bigint')
+        self.basket.connect_foreign_column(self.fruit,'fruit_id')
+        self.basket.upload_appends_bulk([{'qty':10,'fruit_id':1},{'qty':20,'fruit_id':3},{'qty':30}])
+        self.category = ss.create_table('category',name='text')
+        self.category.append_column(parent_id='bigint')
+        self.category.connect_foreign_column(self.category,'parent_id')
+        self.category.upload_appends_bulk([{'name':'root'},{'name':'child','parent_id':1},
+                                           {'name':'grandchild','parent_id':2},{'name':'other'}])
+
+class TestUploadAppendsBulk(PostgresTestCase):
+    def test_float_ids_with_nan(self):
+        df = pd.DataFrame({'color':['a','b','c'],'origin_id':[1,2,None],'qty':[3.0,4.0,5.0]})
+        for method in ['copy','values']:
+            with _statements(self.engine) as statements:
+                ids = self.fruit.upload_appends_bulk(df,method=method)
+            self.assertEqual(any('pyplus_bulk' in stmt for stmt in statements),method == 'copy')
+            df_read = self.fruit.read().loc[ids]
+            self.assertEqual(df_read['origin_id'].fillna(0).to_list(),[1,2,0])
+            self.assertEqual(df_read['qty'].to_list(),[3,4,5])
+
+class TestUploadDataframe(PostgresTestCase):
+    def test_staged_and_values_paths(self):
+        ids = self.fruit.upload_appends_bulk(pd.DataFrame({'color':['a','b'],'qty':[1,2]}))
+        df = pd.DataFrame({'origin_id':[1.0,np.nan],'qty':[5.0,6.0],'color':['c',None]},index=ids)
+        for threshold in [0,10000]:
+            with _statements(self.engine) as statements:
+                self.fruit.upload_dataframe(df,staging_threshold=threshold)
+            self.assertEqual(any('pyplus_update' in stmt for stmt in statements),threshold == 0)
+            df_read = self.fruit.read().loc[ids]
+            self.assertEqual(df_read['origin_id'].fillna(0).to_list(),[1,0])
+            self.assertEqual(df_read['qty'].to_list(),[5,6])
+            self.assertEqual(df_read['color'].fillna('').to_list(),['c',''])
+            self.fruit.upload_dataframe(pd.DataFrame({'origin_id':[2,2],'qty':[0,0],'color':['x','x']},index=ids))
+
+class TestReadExpand(PostgresTestCase):
+    def test_join_equals_pandas(self):
+        for ts in [self.basket,self.fruit,self.category]:
+            for remove_original_id in [False,True]:
+                df_join = ts.read_expand(remove_original_id=remove_original_id,expansion='join')
+                df_pandas = ts.read_expand(remove_original_id=remove_original_id,expansion='pandas')
+                pd.testing.assert_frame_equal(df_join,df_pandas)
+
+    def test_foreign_columns(self):
+        df = self.basket.read_expand(ascending=True)
+        self.assertEqual(df['fruit_id.color'].fillna('').to_list(),['red','green',''])
+        self.assertEqual(df['fruit_id.origin_id.country'].fillna('').to_list(),['kr','',''])
+
+class TestUpload(PostgresTestCase):
+    def test_return_mode(self):
+        self.assertIsNone(self.fruit.upload(1,return_mode='none',color='cherry'))
+        df = self.fruit.upload(2,return_mode='returning',color='lemon')
+        self.assertEqual(df.index.to_list(),[2])
+        self.assertEqual(df['color'].to_list(),['lemon'])
+        df = self.fruit.upload(3,return_mode='full',qty=7)
+        pd.testing.assert_frame_equal(df,self.fruit.read())
+        self.assertEqual(df['color'].to_list(),['green','lemon','cherry'])
+        self.assertEqual(df.loc[3,'qty'],7)
+
+    def test_foreign_column(self):
+        self.basket.upload(1,return_mode='none',**{'fruit_id.color':'plum'})
+        self.assertEqual(self.fruit.read().loc[1,'color'],'plum')
+
+    def test_upload_appends(self):
+        df = self.fruit.upload_appends({'color':'lime'},{'color':'kiwi','origin_id':2},return_mode='returning')
+        self.assertEqual(df['color'].to_list(),['kiwi','lime'])
+        self.assertIsNone(self.fruit.upload_appends({'color':'fig'},return_mode='none'))
+        self.assertIn('fig',self.fruit.read()['color'].to_list())
+
+class TestSession(PostgresTestCase):
+    def test_flush(self):
+        with session(self.engine) as uow:
+            uow.table(self.fruit).upload(1,color='cherry')
+            uow.table(self.fruit).upload(1,qty=9)
+            uow.table(self.basket).append(qty=40,fruit_id=2)
+            uow.table(self.basket).delete_row(2) #refers to fruit 3, so deleted first
+            uow.table(self.fruit).delete_row(3)
+        self.assertEqual(self.fruit.read().loc[1,['color','qty']].to_list(),['cherry',9])
+        self.assertNotIn(3,self.fruit.read().index)
+        self.assertEqual(sorted(self.basket.read()['qty'].to_list()),[10,30,40])
+        self.assertEqual(len(uow.inserted[('fx','basket')]),1)
+
+    def test_rollback(self):
+        before = self.fruit.read()
+        with self.assertRaises(ValueError):
+            with session(self.engine) as uow:
+                uow.table(self.fruit).upload(1,color='cherry')
+                raise ValueError
+        with self.assertRaises(sqlalchemy.exc.DBAPIError):
+            with session(self.engine) as uow:
+                uow.table(self.fruit).upload(1,color='cherry')
+                uow.table(self.basket).append(qty=1,fruit_id=99)
+        pd.testing.assert_frame_equal(self.fruit.read(),before)
+        self.assertEqual(len(self.basket.read()),3)
+
+class TestLookupIndex(PostgresTestCase):
+    def test_sync_with_writes(self):
+        lookup = self.fruit.get_lookup('color')
+        self.assertEqual(lookup.to_dict(),{'red':1,'yellow':2,'green':3})
+        self.fruit.upload(1,return_mode='none',color='cherry')
+        ids = self.fruit.upload_appends_bulk([{'color':'lime'}])
+        self.fruit.delete_row(2)
+        with _statements(self.engine) as statements:
+            self.assertEqual(lookup.to_dict(),{'cherry':1,'green':3,'lime':ids[0]})
+        self.assertEqual(statements,[])
+
+    def test_rollback(self):
+        lookup = self.fruit.get_lookup('color')
+        lookup.to_dict()
+        with self.assertRaises(sqlalchemy.exc.DBAPIError):
+            with session(self.engine) as uow:
+                uow.table(self.fruit).upload(1,color='cherry')
+                uow.table(self.basket).append(qty=1,fruit_id=99)
+        self.assertIsNone(lookup.get_id('cherry'))
+        self.assertEqual(lookup.get_value(1),'red')
+
+    def test_max_rows(self):
+        with self.engine.begin() as conn:
+            conn.execute(text('ANALYZE fx.fruit'))
+        lookup = self.fruit.get_lookup('color',max_rows=1)
+        self.assertFalse(lookup.cached)
+        self.assertEqual(lookup.get_ids(['red','green','none']),{'red':1,'green':3})
+        self.assertIs(self.fruit.get_lookup('color'),lookup)
+        self.assertEqual(lookup.max_rows,1)
+
+class TestChangeListener(PostgresTestCase):
+    def test_write_of_another_connection(self):
+        other = sqlalchemy.create_engine(self.url)
+        self.addCleanup(other.dispose)
+        SchemaStructure('fx',self.engine).install_change_triggers()
+        listener = listen_changes(self.engine)
+        self.addCleanup(listener.stop)
+        seen = []
+        listener.subscribe(lambda schema_name,table_name: seen.append((schema_name,table_name)))
+        lookup = self.fruit.get_lookup('color')
+        self.assertEqual(lookup.get_id('red'),1)
+        with self.fruit.snapshot():
+            self.assertEqual(self.fruit.read_expand()['origin_id.country'].fillna('').to_list(),['','jp','kr'])
+            with other.begin() as conn:
+                conn.execute(text("UPDATE fx.origin SET country = 'us' WHERE id = 1"))
+                conn.execute(text("INSERT INTO fx.fruit (color) VALUES ('lime')"))
+            self.assertTrue(_wait(lambda: ('fx','fruit') in seen))
+            self.assertIn(('fx','origin'),seen)
+            self.assertIn(('fx','basket'),seen)
+            self.assertEqual(self.fruit.read_expand()['origin_id.country'].fillna('').to_list(),['','','jp','us'])
+        self.assertEqual(lookup.get_id('lime'),4)
+        self.assertGreaterEqual(listener.versions[('fx','fruit')],2)
+
+if __name__ == '__main__':
+    unittest.main()